@@ -222,6 +222,29 @@ def get_parser():
         metavar="DIR",
         help="temporary files will be written to this directory"
     )
+    bam2vcf_parser.add_argument(
+        "--jobs",
+        metavar="INT",
+        type=int,
+        default=1,
+        help="number of BAM files processed at a time by GATK "
+            + "HaplotypeCaller, or of shards processed at a time by "
+            + "BCFtools [1]"
+    )
+    bam2vcf_parser.add_argument(
+        "--hc_java_options",
+        metavar="STR",
+        help="Java-specific arguments for each GATK HaplotypeCaller job "
+            + "(default: same as --java_options)"
+    )
+    bam2vcf_parser.add_argument(
+        "--shard_size",
+        metavar="INT",
+        type=int,
+        default=0,
+        help="maximum number of BAM files per BCFtools shard, 0 for a "
+            + "single shard [0]"
+    )
 
     bam2vcf2_parser = subparsers.add_parser(
         "bam2vcf2",
@@ -244,7 +267,8 @@ def get_parser():
     )
     bam2gdf_parser.add_argument(
         "target_gene",
-        help="name of target gene (e.g. 'cyp2d6')",
+        help="name of target gene (e.g. 'cyp2d6'), comma-separated "
+            + "names of target genes or 'ALL'",
     )
     bam2gdf_parser.add_argument(
         "control_gene",
@@ -253,13 +277,25 @@ def get_parser():
     )
     bam2gdf_parser.add_argument(
         "output_file",
-        help="write output to this file"
+        help="write output to this file (directory for multiple genes)"
     )
     bam2gdf_parser.add_argument(
         "bam_file",
         nargs="*",
         help="input BAM files"
     )
+    bam2gdf_parser.add_argument(
+        "--jobs",
+        metavar="INT",
+        type=int,
+        default=1,
+        help="number of processes for computing read depth [1]"
+    )
+    bam2gdf_parser.add_argument(
+        "--cache_dir",
+        metavar="DIR",
+        help="directory for caching read depth across runs"
+    )
 
     gt2html_parser = subparsers.add_parser(
         "gt2html",
@@ -312,7 +348,7 @@ def get_parser():
     )
     bam2sdf_parser.add_argument(
         "target_gene",
-        help="target gene",
+        help="target gene, comma-separated target genes or 'ALL'",
     )
     bam2sdf_parser.add_argument(
         "control_gene",
@@ -323,6 +359,18 @@ def get_parser():
         nargs="+",
         help="BAM file",
     )
+    bam2sdf_parser.add_argument(
+        "--jobs",
+        metavar="INT",
+        type=int,
+        default=1,
+        help="number of processes for computing read depth [1]"
+    )
+    bam2sdf_parser.add_argument(
+        "--cache_dir",
+        metavar="DIR",
+        help="directory for caching read depth across runs"
+    )
 
     sdf2gdf_parser = subparsers.add_parser(
         "sdf2gdf",
@@ -361,7 +409,8 @@ def get_parser():
     )
     minivcf_parser.add_argument(
         "region",
-        help="target region",
+        nargs="+",
+        help="target region(s)",
     )
 
     summary_parser = subparsers.add_parser(
@@ -395,6 +444,17 @@ def get_parser():
         nargs="+",
         help="genotype file",
     )
+    compare_group = compare_parser.add_mutually_exclusive_group()
+    compare_group.add_argument(
+        "--by_gene",
+        action="store_true",
+        help="report concordance per gene",
+    )
+    compare_group.add_argument(
+        "--by_allele",
+        action="store_true",
+        help="report concordance per truth star allele",
+    )
 
     check_parser = subparsers.add_parser(
         "check",
@@ -491,6 +551,27 @@ def get_parser():
         help="tab-delimited text file with two columns representing "
             + "the truth and test sample names",
     )
+    compvcf_parser.add_argument(
+        "--strata",
+        metavar="STR",
+        help="report concordance per stratum, either 'genes' for the "
+            + "target genes or a BED file"
+    )
+    compvcf_parser.add_argument(
+        "--genome_build",
+        metavar="STR",
+        default="hg19",
+        help="genome build ('hg19' or 'hg38') used with '--strata genes' "
+            + "[hg19]"
+    )
+    compvcf_parser.add_argument(
+        "--jobs",
+        metavar="INT",
+        type=int,
+        default=1,
+        help="number of processes over which sample pairs are "
+            + "distributed [1]"
+    )
 
     unicov_parser = subparsers.add_parser(
         "unicov",
@@ -506,6 +587,32 @@ def get_parser():
         nargs="*",
         help="input BAM files"
     )
+    unicov_parser.add_argument(
+        "--jobs",
+        metavar="INT",
+        type=int,
+        default=1,
+        help="number of processes for computing read depth [1]"
+    )
+    unicov_parser.add_argument(
+        "--cache_dir",
+        metavar="DIR",
+        help="directory for caching read depth across runs"
+    )
+
+    unicov_parser.add_argument(
+        "--coverage",
+        metavar="INT",
+        type=int,
+        nargs="+",
+        help="coverages to report [1 10 20 30 40 50 100 200 300 400 500 "
+            + "1000]"
+    )
+    unicov_parser.add_argument(
+        "--by_interval",
+        action="store_true",
+        help="report mean depth and coverages for each interval"
+    )
 
     return parser
 
@@ -1,10 +1,9 @@
 import os
-from io import StringIO
 from typing import List, Optional
 
-from .bam2sdf import bam2sdf
-from .sdf2gdf import sdf2gdf
-from .common import sm_tag, bam_getter
+from .bam2sdf import bam2depths, parse_genes
+from .sdf2gdf import gdf_header, format_gdf
+from .common import bam_headers, bam_getter
 
 @bam_getter
 def bam2gdf(
@@ -15,6 +14,8 @@ def bam2gdf(
         bam_file: List[str],
         bam_dir: Optional[str] = None,
         bam_list: Optional[str] = None,
+        jobs: int = 1,
+        cache_dir: Optional[str] = None,
         **kwargs
     ) -> None:
     """Convert BAM files to a GDF file.
@@ -24,11 +25,11 @@ def bam2gdf(
     files for the Stargazer program. Even though ``gatk DepthOfCoverage`` 
     could still be used to make GDF files, we recommend that you use this 
     command because the former is too heavy (i.e. requires too much memory) 
-    for such a simple task (i.e. counting reads). The latter uses 
-    ``samtools depth`` under the hood, which is way faster and requires 
-    way less memory. Another nice about using ``bam2gdf`` instead of 
-    ``samtools depth`` is that everything is already parametrized for 
-    compatibility with Stargazer. 
+    for such a simple task (i.e. counting reads). The latter counts reads 
+    directly from the BAM files with the same rules as ``samtools depth``, 
+    which is way faster and requires way less memory. Another nice about 
+    using ``bam2gdf`` instead of ``samtools depth`` is that everything is 
+    already parametrized for compatibility with Stargazer. 
 
     .. note::
         You do NOT need to install ``samtools`` to run this command.
@@ -37,24 +38,44 @@ def bam2gdf(
         genome_build (str):
             Genome build ('hg19' or 'hg38').
         target_gene (str):
-            Name of target gene (e.g. 'cyp2d6').
+            Name of target gene (e.g. 'cyp2d6'). Multiple genes can be
+            given as a comma-separated list (e.g. 'cyp2b6,cyp2d6') or as
+            'ALL' for all target genes, in which case the BAM files are
+            traversed once for all genes.
         control_gene (str):
             Name or region of control gene (e.g. ‘vdr’, 
             ‘chr12:48232319-48301814’)
         output_file (str):
-            Write output to this file.
+            Write output to this file. For multiple target genes, write
+            one file per gene (``<gene>.gdf``) to this directory.
         bam_file (list[str]):
             Input BAM files.
         bam_dir (str, optional):
             Use all BAM files in this directory as input.
         bam_list (str, optional):
             List of input BAM files, one file per line.
+        jobs (int):
+            Number of processes for depth computation.
+        cache_dir (str, optional):
+            Reuse read depth stored in this directory by earlier runs and
+            store newly computed read depth there.
     """
     # Parse keyward arguments from the decorator.
     input_files = kwargs["input_files"]
 
-    sdf = bam2sdf(genome_build, target_gene, control_gene, input_files)
-    sm = [sm_tag(x) for x in input_files]
-    result = sdf2gdf(None, sm, f=StringIO(sdf))
-    with open(output_file, "w") as f:
-        f.write(result)
+    target_genes = parse_genes(target_gene)
+    depths = bam2depths(genome_build, target_genes, control_gene,
+                        input_files, jobs, cache_dir)
+    sm = [x.sample for x in bam_headers(input_files)]
+
+    if len(target_genes) > 1:
+        os.makedirs(output_file, exist_ok=True)
+        output_files = {x: f"{output_file}/{x}.gdf" for x in target_genes}
+    else:
+        output_files = {target_genes[0]: output_file}
+
+    for gene, depth in depths.items():
+        with open(output_files[gene], "w") as f:
+            f.write(gdf_header(sm))
+            for x in depth:
+                f.write(format_gdf(*x))
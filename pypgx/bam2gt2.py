@@ -2,11 +2,13 @@ import configparser
 from os import mkdir
 from os.path import realpath
 from .bam2vcf2 import bam2vcf2
-from .common import conf_env, get_target_genes, sm_tag, LINE_BREAK1, randstr
+from .common import (
+    conf_env, get_target_genes, bam_headers, LINE_BREAK1, randstr
+)
 
 def _write_bam2gdf_shell(
         genome_build,
-        target_gene,
+        target_genes,
         control_gene,
         bam_files,
         gdf_file,
@@ -15,7 +17,7 @@ def _write_bam2gdf_shell(
     s = (
         "pypgx bam2gdf \\\n"
         f"  {genome_build} \\\n"
-        f"  {target_gene} \\\n"
+        f"  {','.join(target_genes)} \\\n"
         f"  {control_gene} \\\n"
         f"  {gdf_file} \\\n"
     )
@@ -90,7 +92,8 @@ def _write_stargazer_shell(
         project_path,
         control_gene,
         ref_samples,
-        plot
+        plot,
+        gdf_file
     ):
 
     if snp_caller == "bcftools":
@@ -112,7 +115,7 @@ def _write_stargazer_shell(
     if control_gene != "NONE":
         s += (
             f"  --cg {control_gene} \\\n"
-            f"  --gdf $p/pypgx.gdf \\\n"
+            f"  --gdf {gdf_file} \\\n"
         )
 
         if plot:
@@ -129,7 +132,8 @@ def _write_qsub_shell(
         snp_caller,
         qsub_options,
         control_gene,
-        project_path
+        project_path,
+        gdf_job
     ):
     q = "qsub -e $p/log -o $p/log"
 
@@ -144,16 +148,13 @@ def _write_qsub_shell(
         "\n"
     )
 
-    if control_gene != "NONE":
-        s += f"{q} -N $j-bam2gdf $p/shell/bam2gdf.sh\n"
-
     if snp_caller == "bcftools":
         s += f"{q} -N $j-bam2vcf $p/shell/bam2vcf.sh\n"
 
         if control_gene == "NONE":
             s += f"{q} -hold_jid $j-bam2vcf -N $j-stargazer $p/shell/stargazer.sh\n"
         else:
-            s += f"{q} -hold_jid $j-bam2gdf,$j-bam2vcf -N $j-stargazer $p/shell/stargazer.sh\n"
+            s += f"{q} -hold_jid {gdf_job},$j-bam2vcf -N $j-stargazer $p/shell/stargazer.sh\n"
 
     else:
         with open(f"{project_path}/bam2vcf2/example-qsub.sh") as f:
@@ -164,7 +165,7 @@ def _write_qsub_shell(
         if control_gene == "NONE":
             s += f"{q} -hold_jid $j-post-hc -N $j-stargazer $p/shell/stargazer.sh\n"
         else:
-            s += f"{q} -hold_jid $j-bam2gdf,$j-post-hc -N $j-stargazer $p/shell/stargazer.sh\n"
+            s += f"{q} -hold_jid {gdf_job},$j-post-hc -N $j-stargazer $p/shell/stargazer.sh\n"
 
     with open(f"{project_path}/example-qsub.sh", "w") as f:
         f.write(s)
@@ -179,7 +180,8 @@ def bam2gt2(conf_file: str, **kwargs) -> None:
     select genes too). For each gene, the command runs under the hood 
     ``bam2vcf`` with ``bcftools`` caller (i.e. BCFtools) or ``bam2vcf2`` 
     (i.e. GATK) to create the input VCF file. The input GDF file is 
-    created with ``bam2gdf``.
+    created with ``bam2gdf``, which runs once for all genes and
+    traverses each BAM file once.
 
     Args:
         conf_file (str): Configuration file.
@@ -276,10 +278,10 @@ def bam2gt2(conf_file: str, **kwargs) -> None:
     bam_files = {}
 
     with open(bam_list) as f:
-        for line in f:
-            bam = line.strip()
-            name = sm_tag(bam)
-            bam_files[name] = bam
+        bams = [line.strip() for line in f]
+
+    for bam, header in zip(bams, bam_headers(bams)):
+        bam_files[header.sample] = bam
 
     all_genes = get_target_genes()
 
@@ -313,11 +315,41 @@ def bam2gt2(conf_file: str, **kwargs) -> None:
     mkdir(project_path)
     mkdir(f"{project_path}/gene")
 
+    # Read depth of all genes is computed by one job, which traverses
+    # each BAM file once.
+    gdf_job = f"{randstr()}-bam2gdf"
+
     s = (
         "#!/bin/bash\n"
         "\n"
     )
 
+    if control_gene != "NONE":
+        mkdir(f"{project_path}/shell")
+        mkdir(f"{project_path}/log")
+        mkdir(f"{project_path}/gdf")
+
+        if len(select_genes) == 1:
+            gdf_path = f"{project_path}/gdf/{select_genes[0]}.gdf"
+        else:
+            gdf_path = f"{project_path}/gdf"
+
+        _write_bam2gdf_shell(
+            genome_build,
+            select_genes,
+            control_gene,
+            bam_files,
+            gdf_path,
+            f"{project_path}/shell/bam2gdf.sh"
+        )
+
+        q = f"qsub -e {project_path}/log -o {project_path}/log"
+
+        if qsub_options != "NONE":
+            q += f" {qsub_options}"
+
+        s += f"{q} -N {gdf_job} {project_path}/shell/bam2gdf.sh\n"
+
     for select_gene in select_genes:
         s += f"sh {project_path}/gene/{select_gene}/example-qsub.sh\n"
 
@@ -331,16 +363,6 @@ def bam2gt2(conf_file: str, **kwargs) -> None:
         mkdir(f"{gene_path}/shell")
         mkdir(f"{gene_path}/log")
 
-        if control_gene != "NONE":
-            _write_bam2gdf_shell(
-                genome_build,
-                select_gene,
-                control_gene,
-                bam_files,
-                f"{gene_path}/pypgx.gdf",
-                f"{gene_path}/shell/bam2gdf.sh"
-            )
-
         if snp_caller == "bcftools":
             _write_bam2vcf_shell(
                 fasta_file,
@@ -373,12 +395,14 @@ def bam2gt2(conf_file: str, **kwargs) -> None:
             gene_path,
             control_gene,
             ref_samples,
-            plot
+            plot,
+            f"{project_path}/gdf/{select_gene}.gdf"
         )
 
         _write_qsub_shell(
             snp_caller,
             qsub_options,
             control_gene,
-            gene_path
+            gene_path,
+            gdf_job
         )
@@ -1,41 +1,72 @@
 import os
-from typing import List
+import itertools
+from typing import Dict, List, Optional, Tuple
 
-import pysam
+import numpy as np
 
-from .common import logging, sm_tag, get_gene_table
-from .sglib import sort_regions
+from .common import (
+    logging, bam_headers, get_gene_table, get_target_genes
+)
+from .sglib import sort_regions, parse_region
+from .depth import bam_depths, format_sdf
 
 logger = logging.getLogger(__name__)
 
-def bam2sdf(
+def parse_genes(target_gene: str) -> List[str]:
+    """
+    Parse a comma-separated list of target genes.
+
+    Returns:
+        list[str]: Target genes (all of them for 'ALL').
+
+    Args:
+        target_gene (str): Target gene(s) (e.g. 'cyp2d6', 'cyp2b6,cyp2d6',
+            'ALL').
+    """
+    if target_gene == "ALL":
+        return get_target_genes()
+    result = [x.strip() for x in target_gene.split(",") if x.strip()]
+    if not result:
+        raise ValueError("No target gene given")
+    return result
+
+def bam2depths(
         genome_build: str,
-        target_gene: str,
+        target_genes: List[str],
         control_gene: str,
         bam_file: List[str],
-        **kwargs
-    ) -> str:
+        jobs: int = 1,
+        cache_dir: Optional[str] = None
+    ) -> Dict[str, List[Tuple[str, int, np.ndarray]]]:
     """
-    Create SDF file from BAM file(s).
+    Compute read depth of target genes and the control gene from BAM file(s).
+
+    The regions of all genes are merged and each BAM file is traversed
+    once over the merged regions, so the control gene and overlapping
+    target genes are only read once.
 
     Returns:
-        str: SDF file.
+        dict: Contig, start position and read depth with shape
+        (positions, samples) for each region of each target gene, in
+        sorted order.
 
     Args:
         genome_build (str): Genome build (hg19, hg38).
-        target_gene (str): Target gene.
+        target_genes (list[str]): Target genes.
         control_gene (str): Control gene or region.
         bam_file (list[str]): BAM file(s).
+        jobs (int): Number of processes for depth computation.
+        cache_dir (str, optional): Reuse and store read depth in this
+            cache directory.
     """
 
     gene_table = get_gene_table()
 
     targets = [k for k, v in gene_table.items() if v["type"] == "target"]
 
-    if target_gene not in targets:
-        raise ValueError(f"'{target_gene}' is not among target genes: {targets}")
-
-    tr = gene_table[target_gene][f"{genome_build}_region"].replace("chr", "")
+    for target_gene in target_genes:
+        if target_gene not in targets:
+            raise ValueError(f"'{target_gene}' is not among target genes: {targets}")
 
     if "chr" in control_gene or ":" in control_gene:
         cr = control_gene.replace("chr", "")
@@ -48,37 +79,136 @@ def bam2sdf(
 
         cr = gene_table[control_gene][f"{genome_build}_region"].replace("chr", "")
 
-    regions = sort_regions([tr, cr])
-
     # Get sample and sequence names from BAM headers.
-    sm = []
-    sn = []
-    for x in bam_file:
-        sm.append(sm_tag(x))
-
-        result = pysam.view("-H", x).strip().split("\n")
-        for line in result:
-            fields = line.split("\t")
-            if "@SQ" == fields[0]:
-                for field in fields:
-                    if "SN:" in field:
-                        y = field.replace("SN:", "")
-                        if y not in sn:
-                            sn.append(y)
+    headers = bam_headers(bam_file)
+    sm = [x.sample for x in headers]
+    sn = list(dict.fromkeys(
+        itertools.chain.from_iterable(x.contigs for x in headers)))
 
     logger.info(f"Sample IDs: {sm}")
     logger.info(f"Contigs: {sn}")
 
     # Determine whether the "chr" string should be used.
-    if any(["chr" in x for x in sn]):
+    if any([x.is_chr for x in headers]):
         chr_str = "chr"
     else:
         chr_str = ""
 
-    result = ""
-
-    for region in regions:
-        temp = pysam.depth("-a", "-Q", "1", "-r", f"{chr_str}{region}", *bam_file)
-        result += temp
+    regions = {}
+
+    for target_gene in target_genes:
+        tr = gene_table[target_gene][f"{genome_build}_region"].replace("chr", "")
+        regions[target_gene] = [
+            parse_region(chr_str + x) for x in sort_regions([tr, cr])]
+
+    # Merge overlapping and adjacent regions of all genes.
+    merged = []
+    for contig, start, end in sorted(set(sum(regions.values(), []))):
+        if merged and contig == merged[-1][0] and start <= merged[-1][2] + 1:
+            merged[-1][2] = max(merged[-1][2], end)
+        else:
+            merged.append([contig, start, end])
+
+    depths = bam_depths(bam_file, [f"{x}:{y}-{z}" for x, y, z in merged],
+                        1, jobs, cache_dir)
+
+    result = {}
+
+    for target_gene, gene_regions in regions.items():
+        result[target_gene] = []
+        for contig, start, end in gene_regions:
+            for x, y, depth in depths:
+                if x == contig and y <= start <= y + depth.shape[0]:
+                    i = start - y
+                    j = min(end - y + 1, depth.shape[0])
+                    result[target_gene].append(
+                        (contig, start, depth[i:max(i, j)]))
+                    break
+            else:
+                result[target_gene].append(
+                    (contig, start, np.zeros((0, len(bam_file)),
+                                             dtype=np.int32)))
 
     return result
+
+def bam2depth(
+        genome_build: str,
+        target_gene: str,
+        control_gene: str,
+        bam_file: List[str],
+        jobs: int = 1,
+        cache_dir: Optional[str] = None
+    ) -> List[Tuple[str, int, np.ndarray]]:
+    """
+    Compute read depth of the target and control genes from BAM file(s).
+
+    See :func:`bam2depths` for details.
+
+    Returns:
+        list[tuple]: Contig, start position and read depth with shape
+        (positions, samples) for each region, in sorted order.
+
+    Args:
+        genome_build (str): Genome build (hg19, hg38).
+        target_gene (str): Target gene.
+        control_gene (str): Control gene or region.
+        bam_file (list[str]): BAM file(s).
+        jobs (int): Number of processes for depth computation.
+        cache_dir (str, optional): Reuse and store read depth in this
+            cache directory.
+    """
+    return bam2depths(genome_build, [target_gene], control_gene, bam_file,
+                      jobs, cache_dir)[target_gene]
+
+def bam2sdf(
+        genome_build: str,
+        target_gene: str,
+        control_gene: str,
+        bam_file: List[str],
+        jobs: int = 1,
+        cache_dir: Optional[str] = None,
+        output: Optional[str] = None,
+        **kwargs
+    ) -> Optional[str]:
+    """
+    Create SDF file from BAM file(s).
+
+    With more than one target gene (a comma-separated list or 'ALL'), the
+    BAM files are traversed once and one SDF file per gene
+    (``<gene>.sdf``) is written to the ``output`` directory.
+
+    Returns:
+        str: SDF file, unless there is more than one target gene.
+
+    Args:
+        genome_build (str): Genome build (hg19, hg38).
+        target_gene (str): Target gene(s) (e.g. 'cyp2d6', 'cyp2b6,cyp2d6',
+            'ALL').
+        control_gene (str): Control gene or region.
+        bam_file (list[str]): BAM file(s).
+        jobs (int): Number of processes for depth computation.
+        cache_dir (str, optional): Reuse and store read depth in this
+            cache directory.
+        output (str, optional): Output directory for multiple target genes.
+    """
+    target_genes = parse_genes(target_gene)
+
+    if len(target_genes) == 1:
+        depth = bam2depth(genome_build, target_genes[0], control_gene,
+                          bam_file, jobs, cache_dir)
+        return "".join([format_sdf(*x) for x in depth])
+
+    if not output:
+        raise ValueError("Output directory is required for multiple target genes")
+
+    depths = bam2depths(genome_build, target_genes, control_gene, bam_file,
+                        jobs, cache_dir)
+
+    os.makedirs(output, exist_ok=True)
+
+    for gene, depth in depths.items():
+        with open(f"{output}/{gene}.sdf", "w") as f:
+            for x in depth:
+                f.write(format_sdf(*x))
+
+    return None
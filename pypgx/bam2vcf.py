@@ -1,7 +1,11 @@
 import os
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List
-from .common import get_target_region, is_chr, temp_env, bam_getter
+from .common import get_target_region, bam_headers, temp_env, bam_getter
+
+# Maximum number of files opened by a single bcftools merge.
+MERGE_SIZE = 64
 
 def _run_haplotypecaller(
         fasta_file,
@@ -107,18 +111,72 @@ def _run_mpileup(
 
 def _run_call(
         vcf_file1,
-        vcf_file2
+        vcf_file2,
+        variants_only=True
     ):
     command = [
         "bcftools", "call",
         vcf_file1,
         "-Oz",
-        "-mv",
+        "-mv" if variants_only else "-m",
         "-o", vcf_file2
     ]
 
     subprocess.run(command, check=True)
 
+def _run_merge(
+        vcf_files,
+        vcf_file,
+        output_type="u"
+    ):
+    command = [
+        "bcftools", "merge",
+        f"-O{output_type}",
+        "-m", "both",
+        "-o", vcf_file,
+    ] + vcf_files
+
+    subprocess.run(command, check=True)
+
+def _merge_tree(vcf_files, vcf_file, temp_path, jobs=1):
+    # Merge at most MERGE_SIZE files at a time, level by level, so that
+    # bcftools never opens more files than that. Sample order is kept.
+    level = 0
+
+    while len(vcf_files) > MERGE_SIZE:
+        groups = [vcf_files[i:i + MERGE_SIZE]
+                  for i in range(0, len(vcf_files), MERGE_SIZE)]
+        outputs = [x[0] if len(x) == 1 else
+                   f"{temp_path}/merge{level}_{i}.vcf.gz"
+                   for i, x in enumerate(groups)]
+
+        def f(i):
+            if len(groups[i]) > 1:
+                _run_merge(groups[i], outputs[i], output_type="z")
+                _run_index(outputs[i])
+
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            list(executor.map(f, range(len(groups))))
+
+        vcf_files = outputs
+        level += 1
+
+    _run_merge(vcf_files, vcf_file)
+
+def _run_view(
+        vcf_file1,
+        vcf_file2
+    ):
+    command = [
+        "bcftools", "view",
+        vcf_file1,
+        "-Oz",
+        "-c", "1",
+        "-o", vcf_file2,
+    ]
+
+    subprocess.run(command, check=True)
+
 def _run_index(vcf_file):
     command = [
         "bcftools", "index",
@@ -170,6 +228,9 @@ def bam2vcf(
         dbsnp_file: Optional[str] = None,
         java_options: Optional[str] = None,
         temp_dir: Optional[str] = None,
+        jobs: int = 1,
+        hc_java_options: Optional[str] = None,
+        shard_size: int = 0,
         **kwargs
     ) -> None:
     """Convert BAM files to a VCF file.
@@ -206,6 +267,16 @@ def bam2vcf(
             Java-specific arguments for GATK (e.g. '-Xmx4G').
         temp_dir (str, optional):
             Temporary files will be written to this directory.
+        jobs (int):
+            Number of BAM files processed at a time by GATK
+            HaplotypeCaller, or of shards processed at a time by BCFtools.
+        hc_java_options (str, optional):
+            Java-specific arguments for each GATK HaplotypeCaller job
+            (e.g. '-Xmx2G'), so that several JVMs fit in memory
+            (default: ``java_options``).
+        shard_size (int):
+            Maximum number of BAM files per BCFtools shard (0 for a single
+            shard). Shards are merged at most 64 at a time.
 
     .. warning::
         GATK and/or BCFtools must be pre-installed.
@@ -217,14 +288,15 @@ def bam2vcf(
         ``bcftools`` caller. Therefore, if you have many samples and you do 
         not have access to Sun Grid Engine (SGE) for parallelism, we 
         recommend that you use ``bcftools``. If you have SGE and want to 
-        use GATK, please check ``bam2vcf2``.
+        use GATK, please check ``bam2vcf2``. Without SGE, ``jobs`` runs 
+        HaplotypeCaller on several BAM files at a time.
     """
     # Parse keyward arguments from the decorators.
     temp_path = kwargs["temp_path"]
     input_files = kwargs["input_files"]
 
     # Pick the chromosome string.
-    _ = [is_chr(x) for x in input_files]
+    _ = [x.is_chr for x in bam_headers(input_files)]
 
     if all(_):
         chr_str = "chr"
@@ -243,20 +315,26 @@ def bam2vcf(
     # Run the selected SNP caller.
     if snp_caller == "gatk":
 
-        gvcf_files = []
+        gvcf_files = [f"{temp_path}/{i}.g.vcf"
+                      for i in range(len(input_files))]
 
-        for i, input_file in enumerate(input_files):
-            gvcf_file = f"{temp_path}/{i}.g.vcf"
-            gvcf_files.append(gvcf_file)
+        if hc_java_options is None:
+            hc_java_options = java_options
 
+        def f(x):
             _run_haplotypecaller(
                 fasta_file,
-                input_file,
-                gvcf_file,
+                x[0],
+                x[1],
                 target_region,
-                java_options
+                hc_java_options
             )
 
+        # Each job is a separate JVM, so threads are enough to bound
+        # the number of them running at a time.
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            list(executor.map(f, zip(input_files, gvcf_files)))
+
         _run_genomicsdbimport(
             target_region,
             gvcf_files,
@@ -279,17 +357,58 @@ def bam2vcf(
         )
 
     elif snp_caller == "bcftools":
-        _run_mpileup(
-            fasta_file,
-            target_region,
-            input_files,
-            f"{temp_path}/uncompressed.bcf"
-        )
+        if 0 < shard_size < len(input_files):
+            shards = [input_files[i:i + shard_size]
+                      for i in range(0, len(input_files), shard_size)]
+
+            # Reference sites are kept in each shard so that samples
+            # without a variant called in another shard still get a
+            # genotype after merging.
+            def f(i):
+                _run_mpileup(
+                    fasta_file,
+                    target_region,
+                    shards[i],
+                    f"{temp_path}/shard{i}.bcf"
+                )
+
+                _run_call(
+                    f"{temp_path}/shard{i}.bcf",
+                    f"{temp_path}/shard{i}.vcf.gz",
+                    variants_only=False
+                )
+
+                _run_index(
+                    f"{temp_path}/shard{i}.vcf.gz"
+                )
+
+            with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+                list(executor.map(f, range(len(shards))))
+
+            _merge_tree(
+                [f"{temp_path}/shard{i}.vcf.gz" for i in range(len(shards))],
+                f"{temp_path}/merged.bcf",
+                temp_path,
+                jobs
+            )
 
-        _run_call(
-            f"{temp_path}/uncompressed.bcf",
-            f"{temp_path}/calls.vcf.gz"
-        )
+            _run_view(
+                f"{temp_path}/merged.bcf",
+                f"{temp_path}/calls.vcf.gz"
+            )
+
+        else:
+            _run_mpileup(
+                fasta_file,
+                target_region,
+                input_files,
+                f"{temp_path}/uncompressed.bcf"
+            )
+
+            _run_call(
+                f"{temp_path}/uncompressed.bcf",
+                f"{temp_path}/calls.vcf.gz"
+            )
 
         _run_index(
             f"{temp_path}/calls.vcf.gz"
@@ -1,7 +1,7 @@
 import configparser
 from os import mkdir
 from os.path import realpath
-from .common import is_chr, randstr, conf_env, get_target_region
+from .common import bam_headers, randstr, conf_env, get_target_region
 
 @conf_env
 def bam2vcf2(conf_file: str, **kwargs) -> None:
@@ -102,7 +102,7 @@ def bam2vcf2(conf_file: str, **kwargs) -> None:
     mkdir(f"{project_path}/log")
     mkdir(f"{project_path}/temp")
 
-    t = [is_chr(x) for x in bam_files]
+    t = [x.is_chr for x in bam_headers(bam_files)]
     if all(t):
         chr_str = "chr"
     elif not any(t):
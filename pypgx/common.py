@@ -1,16 +1,26 @@
 import os
+import sys
 import logging
 import random
 import string
 import configparser
-from typing import Dict, List, Optional
+import threading
+import itertools
+import io
+import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Dict, List, Optional, Tuple, TextIO, Iterator, Iterable, Union
+)
 from tempfile import TemporaryDirectory
 import pysam
+import numpy as np
+import pandas as pd
 from functools import wraps
 
 import copy
 import gzip
-import statistics
 
 from .sglib import (
     read_gene_table,
@@ -19,7 +29,11 @@ from .sglib import (
     read_star_table,
     build_stardb,
     StarAllele,
+    parse_region,
 )
+from .snapshot import load_snapshot
+
+logger = logging.getLogger(__name__)
 
 LINE_BREAK1 = "-" * 70
 LINE_BREAK2 = "*" * 70
@@ -29,143 +43,299 @@ LINE_BREAK2 = "*" * 70
 
 
 
+def _merge_regions(
+        region: Union[str, List[str]]
+    ) -> Dict[str, List[Tuple[int, int]]]:
+    """Parses regions and merges overlapping ones, per contig.
+
+    The ``chr`` string is removed from contig names. A region without
+    coordinates (e.g. ``chr22``) covers the whole contig.
+    """
+    if isinstance(region, str):
+        region = [region]
+
+    intervals = {}
+
+    for x in region:
+        if ":" in x:
+            chr, start, end = parse_region(x, omit=True)
+        else:
+            chr, start, end = x.replace("chr", ""), 1, sys.maxsize
+        intervals.setdefault(chr, []).append((start, end))
+
+    result = {}
+
+    for chr, l in intervals.items():
+        merged = []
+        for start, end in sorted(l):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        result[chr] = merged
+
+    return result
+
+def _parse_schema(meta: List[str]) -> Dict[str, Dict[str, Tuple[str, str]]]:
+    """Returns the Number and Type of each INFO and FORMAT key declared in
+    the meta information lines."""
+    result = {"INFO": {}, "FORMAT": {}}
+
+    for line in meta:
+        for section in result:
+            if not line.startswith(f"##{section}=<"):
+                continue
+            d = {}
+            for item in line.strip()[len(section) + 4:-1].split(","):
+                if "=" in item:
+                    k, v = item.split("=", 1)
+                    d.setdefault(k, v)
+            if "ID" in d:
+                result[section][d["ID"]] = (d.get("Number", "."),
+                                            d.get("Type", "String"))
+
+    return result
+
+def _convert_value(s: str, number: str, type: str):
+    if type == "Flag":
+        return True
+    if type == "Integer":
+        f = int
+    elif type == "Float":
+        f = float
+    else:
+        f = str
+    values = [None if x == "." else f(x) for x in s.split(",")]
+    if number in ["0", "1"]:
+        return values[0]
+    return values
+
+def _parse_info(s: str) -> Dict[str, str]:
+    d = {}
+    if s != ".":
+        for x in s.split(";"):
+            k, sep, v = x.partition("=")
+            d[k] = v if sep else True
+    return d
+
+def _format_info(x: Dict[str, str]) -> str:
+    if not x:
+        return "."
+    return ";".join(k if v is True else f"{k}={v}" for k, v in x.items())
+
+def _parse_qual(s: str) -> int:
+    return 0 if s == "." else int(s)
+
+def _parse_filter(s: str) -> List[str]:
+    return [] if s == "." else s.split(";")
+
+_PARSERS = {
+    1: int,
+    4: lambda s: s.split(","),
+    5: _parse_qual,
+    6: _parse_filter,
+    7: _parse_info,
+    8: lambda s: s.split(":"),
+}
+
+_SERIALIZERS = {
+    1: str,
+    4: ",".join,
+    5: lambda x: str(x) if x else ".",
+    6: lambda x: ";".join(x) if x else ".",
+    7: _format_info,
+    8: ":".join,
+}
+
 class Record:
     """Stores data for single SNP record.
 
+    Columns are parsed on first access and the typed result is cached.
+    Columns modified through the property setters are only serialized back
+    to text when ``fields`` is accessed (e.g. when the record is written).
+    Values returned by the properties are copies; use the setters to
+    modify a record.
+
     Args:
         fields: SNP data in columns.
+        schema: INFO and FORMAT definitions from the VCF meta information
+            lines, used for typed access (see :meth:`typed_info`).
 
     Attributes:
         fields (list of str): SNP data in columns.
+        schema (dict): INFO and FORMAT definitions.
     """
 
-    def __init__(self, fields: List[str]):
+    __slots__ = ("_fields", "_cache", "_dirty", "schema")
+
+    def __init__(self,
+                 fields: List[str],
+                 schema: Optional[Dict] = None):
         """Inits a Record."""
-        self.fields = fields
+        self._fields = fields
+        self._cache = {}
+        self._dirty = set()
+        self.schema = schema
+
+    def _get(self, i: int):
+        try:
+            return self._cache[i]
+        except KeyError:
+            x = self._cache[i] = _PARSERS[i](self._fields[i])
+            return x
+
+    def _set(self, i: int, x) -> None:
+        if i == 7:
+            self._cache.pop("typed_info", None)
+        self._cache[i] = x
+        self._dirty.add(i)
+
+    @property
+    def fields(self):
+        """list of str: SNP data in columns. Pending changes are serialized
+        first; the list may then be modified in place."""
+        for i in self._dirty:
+            self._fields[i] = _SERIALIZERS[i](self._cache[i])
+        self._dirty.clear()
+        self._cache.clear()
+        return self._fields
+
+    @fields.setter
+    def fields(self, x: List[str]):
+        self._fields = x
+        self._dirty.clear()
+        self._cache.clear()
 
     @property
     def chrom(self):
         """str: Chromosome."""
-        return self.fields[0]
+        return self._fields[0]
 
     @chrom.setter
     def chrom(self, x: str):
-        self.fields[0] = x
+        self._fields[0] = x
 
     @property
     def pos(self):
         """int: Position."""
-        return int(self.fields[1])
+        return self._get(1)
 
     @pos.setter
     def pos(self, x: int):
-        self.fields[1] = str(x)
+        self._set(1, int(x))
 
     @property
     def id(self):
         """str: Identifier."""
-        return self.fields[2]
+        return self._fields[2]
 
     @id.setter
     def id(self, x: str):
-        self.fields[2] = x
+        self._fields[2] = x
 
     @property
     def ref(self):
         """str: Reference allele."""
-        return self.fields[3]
+        return self._fields[3]
 
     @ref.setter
     def ref(self, x: str):
-        self.fields[3] = x
+        self._fields[3] = x
 
     @property
     def alt(self):
         """list of str: Alternate allele(s)."""
-        return self.fields[4].split(",")
+        return list(self._get(4))
 
     @alt.setter
     def alt(self, x: List[str]):
-        self.fields[4] = ",".join(x)
+        self._set(4, list(x))
 
     @property
     def qual(self):
         """int: Quality. 0 is equivalent to the missing value."""
-        s = self.fields[5]
-        if s == ".":
-            return 0
-        else:
-            return int(s)
+        return self._get(5)
 
     @qual.setter
     def qual(self, x: int):
-        self.fields[5] = str(x) if x else "."
+        self._set(5, x)
 
     @property
     def filter(self):
         """list of str: Filter status. An empty list is equivalent to the
         missing value.
         """
-        s = self.fields[6]
-        if s == ".":
-            return []
-        else:
-            return s.split(";")
+        return list(self._get(6))
 
     @filter.setter
     def filter(self, x: List[str]):
-        self.fields[6] = ";".join(x) if x else "."
+        self._set(6, list(x))
 
     @property
     def info(self):
         """dict of str to str: Additional information. An empty dictionary is
-        equivalent to the missing value.
+        equivalent to the missing value. Flags are mapped to True.
         """
-        s = self.fields[7]
-        if s == ".":
-            return {}
-        d = {}
-        for x in s.split(";"):
-            k = x.split("=")[0]
-            v = x.split("=")[1]
-            d[k] = v
-        return d
+        return dict(self._get(7))
 
     @info.setter
     def info(self, x: Dict[str, str]):
-        if x:
-            l = []
-            for k, v in x.items():
-                l.append(f"{k}={v}")
-            self.fields[7] = ";".join(l)
-        else:
-            self.fields[7] = "."
+        self._set(7, dict(x))
+
+    @property
+    def typed_info(self):
+        """dict: Additional information, with values converted according
+        to the ``##INFO`` meta information lines. Keys with Number other
+        than 0 or 1 map to lists; missing values are None. Undeclared keys
+        keep their text value.
+        """
+        if "typed_info" not in self._cache:
+            defs = self.schema["INFO"] if self.schema else {}
+            d = {}
+            for k, v in self._get(7).items():
+                if v is True or k not in defs:
+                    d[k] = v
+                else:
+                    d[k] = _convert_value(v, *defs[k])
+            self._cache["typed_info"] = d
+        return dict(self._cache["typed_info"])
 
     @property
     def format(self):
         """list of str: Types of genotype data."""
-        return self.fields[8].split(":")
+        return list(self._get(8))
 
     @format.setter
     def format(self, x: List[str]):
-        self.fields[8] = ":".join(x)
+        self._set(8, list(x))
 
     @property
     def data(self):
         """list of str: Genotype data."""
-        return self.fields[9:]
+        return self._fields[9:]
 
     @data.setter
     def data(self, x: List[str]):
-        self.fields[9:] = x
-
-    def has_indel(self) -> bool:
-        """Returns true if the REF or ALT allele is an indel."""
-        return len(self.ref) > 1 or any([len(x) > 1 for x in self.alt])
-
+        self._fields[9:] = x
 
+    def get_sample(self, i: int) -> str:
+        """Returns the genotype data of the i-th sample (0-based)."""
+        return self._fields[9 + i]
 
+    def typed_sample(self, i: int) -> Dict:
+        """Returns the genotype data of the i-th sample (0-based) as a
+        dictionary, with values converted according to the ``##FORMAT``
+        meta information lines.
+        """
+        defs = self.schema["FORMAT"] if self.schema else {}
+        d = {}
+        for k, v in zip(self._get(8), self._fields[9 + i].split(":")):
+            d[k] = _convert_value(v, *defs[k]) if k in defs else v
+        return d
 
+    def has_indel(self) -> bool:
+        """Returns true if the REF or ALT allele is an indel."""
+        return len(self.ref) > 1 or any([len(x) > 1 for x in self._get(4)])
 
 class VCFFile:
     """Versatile object for reading, writing and manipulating a VCF file.
@@ -174,6 +344,8 @@ class VCFFile:
         meta (list of str): Meta information lines.
         header (list of str): Column names.
         data (list of Record): SNP records.
+        schema (dict): INFO and FORMAT definitions parsed from the meta
+            information lines.
     """
 
     def __init__(self, *args, **kwargs):
@@ -183,6 +355,7 @@ class VCFFile:
         self.meta   = []
         self.header = []
         self.data   = []
+        self.schema = _parse_schema([])
 
     @property
     def filepath(self):
@@ -199,133 +372,207 @@ class VCFFile:
         self.meta.clear()
         self.header.clear()
         self.data.clear()
+        self.schema = _parse_schema([])
 
-    def read(self,
-             region: Optional[str] = None,
-             tidy: bool = False) -> None:
-        """Reads the provided VCF file.
+    def _open(self) -> TextIO:
+        if self.filepath.endswith(".gz"):
+            return gzip.open(self.filepath, "rt")
+        else:
+            return open(self.filepath)
+
+    @property
+    def index_file(self) -> str:
+        """str: Tabix (.tbi) or CSI (.csi) index of the VCF file, if any."""
+        if self.filepath.endswith(".gz"):
+            for ext in [".tbi", ".csi"]:
+                if os.path.exists(self.filepath + ext):
+                    return self.filepath + ext
+        return ""
+
+    def iter_records(self,
+                     region: Optional[Union[str, List[str]]] = None,
+                     tidy: bool = False) -> Iterator[Record]:
+        """Reads the provided VCF file lazily.
+
+        Meta information lines and column names are read immediately; SNP
+        records are parsed one at a time as the returned iterator is
+        consumed, so that arbitrarily large files can be processed in
+        constant memory. Records are not stored in ``data``.
+
+        When regions are requested and the file is bgzipped with a tabix
+        or CSI index next to it, only the indexed blocks overlapping the
+        regions are read. Otherwise the file is scanned from the start.
+        Either way, records are returned in file order and only once.
+
+        Returns:
+            iterator of Record: SNP records.
 
         Args:
-            region: If provided, only read VCF data in the region.
+            region: If provided, only read VCF data in the region(s)
+                (e.g. ``chr22:42512500-42551883`` or ``22``).
             tidy: If true, remove ``chr`` string from ``CHROM`` column.
+
+        Filtering a VCF file without loading it::
+
+            vcf = VCFFile("in.vcf")
+            records = vcf.iter_records()
+            with open("out.vcf", "w") as f:
+                vcf.write(f, (x for x in records if x.qual >= 50))
         """
 
         self.clear()
 
-        if region:
-            chr = region.split(":")[0].replace("chr", "")
-            start = int(region.split(":")[1].split("-")[0])
-            end = int(region.split(":")[1].split("-")[1])
+        regions = _merge_regions(region) if region else {}
 
-        if self.filepath.endswith(".gz"):
-            f = gzip.open(self.filepath, "rt")
-        else:
-            f = open(self.filepath)
+        if regions and self.index_file:
+            return self._fetch_records(regions, tidy)
 
-        for line in f:
-            if "##" in line:
-                self.meta.append(line)
-                continue
+        # The header is read here; records are read by the generator, which
+        # opens the file again so that it is only open while iterating.
+        with self._open() as f:
+            for line in f:
+                if line.startswith("##"):
+                    self.meta.append(line)
+                    continue
 
-            fields = line.strip().split("\t")
+                fields = line.strip().split("\t")
 
-            if fields[0] == "#CHROM":
-                self.header = fields
-                continue
+                if fields[0] == "#CHROM":
+                    self.header = fields
 
-            record = Record(fields)
+                break
 
-            if region:
-                if (chr == record.chrom.replace("chr", "") and
-                    start <= record.pos <= end):
-                    pass
-                elif (chr == record.chrom.replace("chr", "") and
-                      end < record.pos):
-                      break
-                else:
-                    continue
+        self.schema = _parse_schema(self.meta)
 
-            if tidy:
-                record.fields[0] = record.fields[0].replace("chr", "")
+        return self._iter_records(regions, tidy)
 
-            self.data.append(record)
+    def _iter_records(self, regions, tidy):
+        # Regions are done once a later record on the same contig is seen.
+        remaining = {k: len(v) for k, v in regions.items()}
 
-        f.close()
+        with self._open() as f:
+            lines = (line.strip().split("\t") for line in f
+                     if not line.startswith("#"))
 
-    def missing_filter(self,
-                       threshold: float = 0.0) -> List[Record]:
-        """Filters out records with missing genotype ``./.``.
+            for fields in lines:
+                record = Record(fields, self.schema)
 
-        Returns:
-            list of Record: Filtered records.
+                if regions:
+                    chr = record.chrom.replace("chr", "")
 
-        Args:
-            threshold: A record will be removed if the fraction of samples
-                with missing genotype is greater than this threshold.
-        """
+                    if chr not in regions:
+                        continue
 
-        filtered = []
+                    intervals = regions[chr]
+                    pos = record.pos
 
-        for i in reversed(range(len(self.data))):
-            record = self.data[i]
-            missing = ["." in x.split(":")[0] for x in record.data]
-            missing = missing.count(True) / len(missing)
+                    while (remaining[chr] and
+                           intervals[-remaining[chr]][1] < pos):
+                        remaining[chr] -= 1
 
-            if missing > threshold:
-                if not record.filter or "PASS" in record.filter:
-                    record.filter = ["MissingFilter"]
-                else:
-                    record.filter += ["MissingFilter"]
+                    if not any(remaining.values()):
+                        break
 
-                filtered.append(self.data.pop(i))
+                    if not remaining[chr]:
+                        continue
 
-        return filtered
+                    if pos < intervals[-remaining[chr]][0]:
+                        continue
 
-    def multiallelic_filter(self) -> List[Record]:
-        """Filters out records with more than two ALT alleles.
+                if tidy:
+                    record.chrom = record.chrom.replace("chr", "")
 
-        Returns:
-            list of Record: Filtered records.
-        """
+                yield record
 
-        filtered = []
+    def _fetch_records(self, regions, tidy):
+        with pysam.TabixFile(self.filepath, index=self.index_file) as f:
+            for line in f.header:
+                if line.startswith("##"):
+                    self.meta.append(line + "\n")
+                elif line.startswith("#CHROM"):
+                    self.header = line.strip().split("\t")
 
-        for i in reversed(range(len(self.data))):
-            record = self.data[i]
+            contigs = list(f.contigs)
 
-            if len(record.alt) > 1:
-                if not record.filter or "PASS" in record.filter:
-                    record.filter = ["MultiallelicFilter"]
-                else:
-                    record.filter += ["MultiallelicFilter"]
+        self.schema = _parse_schema(self.meta)
 
-                filtered.append(self.data.pop(i))
+        queries = []
 
-        return filtered
+        for contig in contigs:
+            chr = contig.replace("chr", "")
+            for start, end in regions.get(chr, []):
+                queries.append((contig, start, end))
 
-    def invalid_allele_filter(self) -> List[Record]:
-        """Filters out records with invalid alleles (e.g. ``I``, ``D``).
+        return self._iter_fetched(queries, tidy)
+
+    def _iter_fetched(self, queries, tidy):
+        with pysam.TabixFile(self.filepath, index=self.index_file) as f:
+            for contig, start, end in queries:
+                for line in f.fetch(contig, start - 1, end):
+                    record = Record(line.strip().split("\t"), self.schema)
+
+                    # Tabix also returns records overlapping the start.
+                    if not start <= record.pos <= end:
+                        continue
+
+                    if tidy:
+                        record.chrom = record.chrom.replace("chr", "")
+
+                    yield record
+
+    def read(self,
+             region: Optional[Union[str, List[str]]] = None,
+             tidy: bool = False) -> None:
+        """Reads the provided VCF file.
+
+        Args:
+            region: If provided, only read VCF data in the region(s). See
+                :meth:`iter_records` for details.
+            tidy: If true, remove ``chr`` string from ``CHROM`` column.
+        """
+
+        self.data = list(self.iter_records(region, tidy))
+
+    def apply_filters(self, pipeline: "FilterPipeline") -> List[Record]:
+        """Filters out records with a filter pipeline, in a single pass.
 
         Returns:
             list of Record: Filtered records.
+
+        Args:
+            pipeline: Filters to apply.
         """
+        self.data, filtered = pipeline.run(self.data)
+        return filtered
 
-        filtered = []
+    def missing_filter(self,
+                       threshold: float = 0.0) -> List[Record]:
+        """Filters out records with missing genotype ``./.``.
 
-        for i in reversed(range(len(self.data))):
-            record = self.data[i]
+        Returns:
+            list of Record: Filtered records.
 
-            if (record.ref in ["I", "D"] or
-                "." in record.alt or "D" in record.alt):
+        Args:
+            threshold: A record will be removed if the fraction of samples
+                with missing genotype is greater than this threshold.
+        """
+        return self.apply_filters(FilterPipeline([MissingFilter(threshold)]))
 
-                if not record.filter or "PASS" in record.filter:
-                    record.filter = ["InvalidAlleleFilter"]
-                else:
-                    record.filter += ["InvalidAlleleFilter"]
+    def multiallelic_filter(self) -> List[Record]:
+        """Filters out records with more than two ALT alleles.
 
-                filtered.append(self.data.pop(i))
+        Returns:
+            list of Record: Filtered records.
+        """
+        return self.apply_filters(FilterPipeline([MultiallelicFilter()]))
 
-        return filtered
+    def invalid_allele_filter(self) -> List[Record]:
+        """Filters out records with invalid alleles (e.g. ``I``, ``D``).
+
+        Returns:
+            list of Record: Filtered records.
+        """
+        return self.apply_filters(FilterPipeline([InvalidAlleleFilter()]))
 
     def allelic_imbalance_filter(self,
                                  threshold: float = 0.8,
@@ -341,57 +588,20 @@ class VCFFile:
             count: Records will not be filtered out if they are indel and
                 have the number of supporting samples less than this count.
         """
+        return self.apply_filters(FilterPipeline(
+            [AllelicImbalanceFilter(threshold, count)]))
 
-        def get_af(x: str, record: Record) -> float:
-            i = record.format.index("GT")
-            gt = x.split(":")[i]
+    def to_matrix(self,
+                  samples: Optional[List[str]] = None) -> "GenotypeMatrix":
+        """Returns a GenotypeMatrix of the loaded records.
 
-            if "|" in gt:
-                gt = gt.split("|")
-            else:
-                gt = gt.split("/")
-
-            i = record.format.index("AD")
-            ad = x.split(":")[i]
-            ad = [int(x) for x in ad.split(",")]
-
-            if "." in gt or gt[0] == gt[1] or sum(ad) == 0:
-                af = 0.0
-            else:
-                af = max(ad) / sum(ad)
-
-            return af
-
-        filtered = []
-
-        for i in reversed(range(len(self.data))):
-            record = self.data[i]
-
-            if "AD" not in record.format:
-                continue
-
-            afs = [get_af(x, record) for x in record.data]
-            afs = [x for x in afs if x]
-
-            if not afs:
-                continue
-
-            median = statistics.median(afs)
-
-            if median <= threshold:
-                continue
-
-            if record.has_indel() and len(afs) < count:
-                continue
-
-            if not record.filter or "PASS" in record.filter:
-                record.filter = ["AllelicImbalanceFilter"]
-            else:
-                record.filter += ["AllelicImbalanceFilter"]
-
-            filtered.append(self.data.pop(i))
-
-        return filtered
+        Args:
+            samples: If provided, only include these samples.
+        """
+        if samples is None:
+            samples = self.header[9:]
+        columns = [self.header.index(x) - 9 for x in samples]
+        return GenotypeMatrix.from_records(self.data, samples, columns)
 
     def search_meta(self, key: str) -> str:
         """Returns the value of the meta-information key, if present."""
@@ -409,31 +619,57 @@ class VCFFile:
         new.meta = copy.deepcopy(self.meta) if meta is None else meta
         new.header = copy.deepcopy(self.header) if header is None else header
         new.data = copy.deepcopy(self.data) if data is None else data
+        new.schema = copy.deepcopy(self.schema)
         return new
 
+    def write_header(self, f: TextIO) -> None:
+        """Writes the meta information lines and column names."""
+        f.writelines(self.meta)
+        f.write("\t".join(self.header) + "\n")
+
+    def write(self,
+              f: TextIO,
+              records: Optional[Iterable[Record]] = None) -> None:
+        """Writes the VCFFile to a file object, one record at a time.
+
+        Args:
+            f: File object to write to.
+            records: Records to write instead of ``data`` (e.g. the
+                iterator returned by :meth:`iter_records`).
+        """
+        self.write_header(f)
+        for record in self.data if records is None else records:
+            f.write("\t".join(record.fields) + "\n")
+
     def to_str(self) -> str:
         """Returns a string representation of the VCFFile."""
-        s = ""
-        for line in self.meta:
-            s += line
-        s += "\t".join(self.header) + "\n"
-        for record in self.data:
-            s += "\t".join(record.fields) + "\n"
-        return s
+        f = io.StringIO()
+        self.write(f)
+        return f.getvalue()
 
-    def to_file(self, filepath: str) -> None:
+    def to_file(self,
+                filepath: str,
+                records: Optional[Iterable[Record]] = None) -> None:
         """Writes the VCFFile to a file."""
         with open(filepath, "w") as f:
-            f.write(self.to_str())
+            self.write(f, records)
 
     def phase(self) -> None:
-        """Changes genotype separator from ``/`` to ``|``."""
+        """Changes genotype separator from ``/`` to ``|``.
+
+        This is a string replacement over the sample columns rather than
+        an operation on a GenotypeMatrix, which is read-only and would
+        have to be formatted back into the records.
+        """
         for record in self.data:
             record.fields[9:] = [x.replace("/", "|") for x
                                  in record.fields[9:]]
 
     def unphase(self) -> None:
-        """Changes genotype separator from ``|`` to ``/``."""
+        """Changes genotype separator from ``|`` to ``/``.
+
+        See :meth:`phase` for why this does not use a GenotypeMatrix.
+        """
         for record in self.data:
             record.fields[9:] = [x.replace("|", "/") for x
                                  in record.fields[9:]]
@@ -442,60 +678,605 @@ class VCFFile:
         """Sorts SNP records by chromosome and then by position."""
         self.data.sort(key = lambda x: (x.chrom, x.pos))
 
+def _parse_gt(s: str) -> Tuple[int, int, bool]:
+    phased = "|" in s
+    x = s.split("|") if phased else s.split("/")
+    a = -1 if x[0] in [".", ""] else int(x[0])
+    if len(x) < 2:
+        b = -2
+    else:
+        b = -1 if x[1] == "." else int(x[1])
+    return a, b, phased
+
+class _CodeTable(dict):
+    """Assigns consecutive integer codes to keys on first lookup."""
+
+    def __missing__(self, key):
+        value = self[key] = len(self)
+        return value
+
+class GenotypeMatrix:
+    """Columnar NumPy view of the genotype data of VCF records.
+
+    The view is built with a single parse of the sample columns, after
+    which per-sample operations can be run as array operations over all
+    records and samples at once.
+
+    Attributes:
+        samples (list of str): Sample names.
+        gt (numpy.ndarray): Allele indices (int16) with shape
+            (records, samples, 2). Missing alleles (``.``) are -1 and the
+            absent second allele of haploid calls is -2.
+        phased (numpy.ndarray): True if the genotype is phased (bool) with
+            shape (records, samples).
+        ad (numpy.ndarray): Allelic depths (int32) with shape (records,
+            samples, max alleles), zero-padded. Zero if AD is absent. AD
+            values are only parsed when first accessed.
+        has_ad (numpy.ndarray): True if the record has AD (bool).
+        n_alleles (numpy.ndarray): Number of REF and ALT alleles (int32).
+    """
+
+    def __init__(self, samples, gt, phased, ad, has_ad, n_alleles):
+        """Inits a GenotypeMatrix."""
+        self.samples = samples
+        self.gt = gt
+        self.phased = phased
+        self._ad = ad
+        self._source = None
+        self.has_ad = has_ad
+        self.n_alleles = n_alleles
+
+    @classmethod
+    def from_records(cls,
+                     records: List[Record],
+                     samples: Optional[List[str]] = None,
+                     columns: Optional[List[int]] = None) -> "GenotypeMatrix":
+        """Builds a GenotypeMatrix from records.
 
+        Args:
+            records: SNP records.
+            samples: Sample names.
+            columns: 0-based indices of the samples to include (default:
+                all samples).
+        """
+        n = len(records)
+
+        if columns is None:
+            columns = list(range(len(records[0].data) if n else 0))
+
+        if samples is None:
+            samples = [str(x) for x in columns]
+
+        k = len(columns)
+        n_alleles = np.ones(n, dtype=np.int32)
+        has_ad = np.zeros(n, dtype=bool)
+        codes = []
+        memo = _CodeTable()
+        columns9 = [x + 9 for x in columns]
+        every = columns == list(range(len(records[0].data) if n else 0))
+
+        for i, record in enumerate(records):
+            format = record._get(8)
+            n_alleles[i] = len(record._get(4)) + 1
+            has_ad[i] = "AD" in format
+            fields = record._fields
+
+            if every:
+                x = fields[9:]
+            else:
+                x = [fields[c] for c in columns9]
 
+            if "GT" not in format:
+                x = ["."] * k
+            else:
+                j = format.index("GT")
+                # Split all samples at once when they have complete data.
+                y = ":".join(x).split(":")
+                if len(y) == k * len(format):
+                    x = y[j::len(format)]
+                else:
+                    x = [y.split(":") for y in x]
+                    x = [y[j] if j < len(y) else "." for y in x]
 
+            codes += map(memo.__getitem__, x)
 
+        table = [_parse_gt(x) for x in memo] or [(-1, -1, False)]
+        codes = np.array(codes, dtype=np.int64).reshape(n, k)
+        gt = np.array([x[:2] for x in table], dtype=np.int16)[codes]
+        phased = np.array([x[2] for x in table], dtype=bool)[codes]
+        result = cls(samples, gt, phased, None, has_ad, n_alleles)
+        result._source = (records, columns)
+        return result
 
+    @property
+    def ad(self) -> np.ndarray:
+        if self._ad is None:
+            self._ad = self._parse_ad(*self._source)
+            self._source = None
+        return self._ad
+
+    def _parse_ad(self, records, columns) -> np.ndarray:
+        n, k = self.gt.shape[:2]
+        shape = (n, k, int(self.n_alleles.max()) if n else 1)
+        ad = np.zeros(shape, dtype=np.int32)
+
+        # AD strings are grouped by number of alleles so that each group
+        # is converted with a single array operation.
+        groups = {}
+
+        for i in np.flatnonzero(self.has_ad):
+            record = records[i]
+            format = record._get(8)
+            j = format.index("AD")
+            x = [record._fields[c + 9] for c in columns]
+            # Split all samples at once when they have complete data.
+            y = ":".join(x).split(":")
+            if len(y) == k * len(format):
+                x = y[j::len(format)]
+            else:
+                x = [z.split(":") for z in x]
+                x = [z[j] if j < len(z) else "." for z in x]
+            groups.setdefault(self.n_alleles[i], []).append((i, x))
+
+        for m, items in groups.items():
+            rows = []
+            for i, x in items:
+                s = ",".join(x)
+                if "." in s or s.count(",") != k * m - 1:
+                    for j, y in enumerate(x):
+                        values = [0 if z in [".", ""] else int(z)
+                                  for z in y.split(",")]
+                        ad[i, j, :len(values)] = values[:ad.shape[2]]
+                else:
+                    rows.append((i, s))
+            if rows and k:
+                values = np.fromstring(",".join([x[1] for x in rows]),
+                                       dtype=np.int32, sep=",")
+                index = [x[0] for x in rows]
+                ad[index, :, :m] = values.reshape(len(rows), k, m)
 
+        return ad
 
+    @property
+    def missing(self) -> np.ndarray:
+        """numpy.ndarray: True if the genotype has a missing allele."""
+        return (self.gt == -1).any(axis=2)
 
+    @property
+    def het(self) -> np.ndarray:
+        """numpy.ndarray: True if the genotype is heterozygous."""
+        a = self.gt[:, :, 0]
+        b = self.gt[:, :, 1]
+        return (a != b) & (a >= 0) & (b >= 0)
+
+    def alt_counts(self) -> np.ndarray:
+        """Returns the number of non-REF alleles in each genotype."""
+        return (self.gt > 0).sum(axis=2)
+
+    def allele_fractions(self) -> np.ndarray:
+        """Returns the fraction of the most supported allele in each
+        heterozygous genotype with reads; other entries are NaN."""
+        total = self.ad.sum(axis=2)
+        keep = self.het & (total > 0) & self.has_ad[:, None]
+        result = np.full(total.shape, np.nan)
+        result[keep] = self.ad.max(axis=2)[keep] / total[keep]
+        return result
 
+class VCFFilter:
+    """Base class for record filters.
 
+    Subclasses implement ``__call__``, which returns true if the record
+    should be filtered out, and/or ``mask``, its vectorized counterpart.
+    Filters that set ``uses_genotypes`` receive a GenotypeMatrix of the
+    records.
 
+    Attributes:
+        name (str): Value added to the ``FILTER`` column of filtered
+            records.
+        uses_genotypes (bool): True if ``mask`` needs a GenotypeMatrix.
+    """
+
+    name = ""
+    uses_genotypes = False
 
+    def __call__(self, record: Record) -> bool:
+        view = None
+        if self.uses_genotypes:
+            view = GenotypeMatrix.from_records([record])
+        return bool(self.mask([record], view)[0])
 
+    def mask(self,
+             records: List[Record],
+             view: Optional[GenotypeMatrix] = None) -> np.ndarray:
+        """Returns true for each record that should be filtered out."""
+        return np.array([self(x) for x in records], dtype=bool)
 
+class MissingFilter(VCFFilter):
+    """Filters out records with missing genotype ``./.``.
 
+    Args:
+        threshold: A record will be removed if the fraction of samples
+            with missing genotype is greater than this threshold.
+    """
 
+    name = "MissingFilter"
+    uses_genotypes = True
 
+    def __init__(self, threshold: float = 0.0):
+        self.threshold = threshold
 
+    def mask(self, records, view=None):
+        if not view.gt.shape[1]:
+            return np.zeros(len(records), dtype=bool)
+        return view.missing.mean(axis=1) > self.threshold
 
-def sm_tag(bam: str) -> str:
+class MultiallelicFilter(VCFFilter):
+    """Filters out records with more than two ALT alleles."""
+
+    name = "MultiallelicFilter"
+
+    def __call__(self, record: Record) -> bool:
+        return len(record.alt) > 1
+
+class InvalidAlleleFilter(VCFFilter):
+    """Filters out records with invalid alleles (e.g. ``I``, ``D``)."""
+
+    name = "InvalidAlleleFilter"
+
+    def __call__(self, record: Record) -> bool:
+        alt = record.alt
+        return record.ref in ["I", "D"] or "." in alt or "D" in alt
+
+class AllelicImbalanceFilter(VCFFilter):
+    """Filters out records with high allelic imbalance.
+
+    Args:
+        threshold: A record is said to have high allelic imbalance if the
+            median of allele fractions is greather than this threshold.
+        count: Records will not be filtered out if they are indel and
+            have the number of supporting samples less than this count.
+    """
+
+    name = "AllelicImbalanceFilter"
+    uses_genotypes = True
+
+    def __init__(self, threshold: float = 0.8, count: int = 3):
+        self.threshold = threshold
+        self.count = count
+
+    def mask(self, records, view=None):
+        afs = view.allele_fractions()
+        n = (~np.isnan(afs)).sum(axis=1)
+        median = np.zeros(len(records))
+        if n.any():
+            median[n > 0] = np.nanmedian(afs[n > 0], axis=1)
+        indel = np.array([x.has_indel() for x in records], dtype=bool)
+        return (n > 0) & (median > self.threshold) & ~(indel & (n < self.count))
+
+class FilterPipeline:
+    """Composes record filters and applies them in a single pass.
+
+    Records are tested against the filters in order. A record is filtered
+    out by the first filter it fails, whose name is then added to its
+    ``FILTER`` column (replacing ``PASS``), exactly as if the filters had
+    been applied one after another.
+
+    Records are processed in chunks of ``chunk_size``, for which filters
+    are evaluated as array operations over a GenotypeMatrix.
+
+    Args:
+        filters: Filters to apply.
+
+    Attributes:
+        filters (list of VCFFilter): Filters to apply.
+        counts (dict of str to int): Number of records filtered out by each
+            filter so far.
+        total (int): Number of records seen so far.
+
+    Filtering a VCF file in constant memory::
+
+        vcf = VCFFile("in.vcf")
+        pipeline = FilterPipeline([MultiallelicFilter(), MissingFilter()])
+        vcf.to_file("out.vcf", pipeline.apply(vcf.iter_records()))
+        print(pipeline.counts)
+    """
+
+    chunk_size = 10000
+
+    def __init__(self, filters: List[VCFFilter]):
+        """Inits a FilterPipeline."""
+        self.filters = filters
+        self.counts = {x.name: 0 for x in filters}
+        self.total = 0
+
+    def apply(self,
+              records: Iterable[Record],
+              filtered: Optional[List[Record]] = None) -> Iterator[Record]:
+        """Yields records that pass all filters.
+
+        Args:
+            records: Records to filter, e.g. from
+                :meth:`VCFFile.iter_records`.
+            filtered: If provided, filtered records are appended to it.
+        """
+        uses_genotypes = any([x.uses_genotypes for x in self.filters])
+        records = iter(records)
+
+        while True:
+            chunk = list(itertools.islice(records, self.chunk_size))
+
+            if not chunk:
+                break
+
+            self.total += len(chunk)
+            view = None
+
+            if uses_genotypes:
+                view = GenotypeMatrix.from_records(chunk)
+
+            # Index of the first filter failed by each record.
+            first = np.full(len(chunk), -1)
+
+            for i, f in enumerate(self.filters):
+                todo = first == -1
+                if not todo.any():
+                    break
+                first[todo & f.mask(chunk, view)] = i
+
+            for record, i in zip(chunk, first):
+                if i == -1:
+                    yield record
+                    continue
+
+                name = self.filters[i].name
+
+                if not record.filter or "PASS" in record.filter:
+                    record.filter = [name]
+                else:
+                    record.filter = record.filter + [name]
+
+                self.counts[name] += 1
+
+                if filtered is not None:
+                    filtered.append(record)
+
+    def run(self,
+            records: Iterable[Record]) -> Tuple[List[Record], List[Record]]:
+        """Returns the records that pass all filters and those that don't.
+
+        Args:
+            records: Records to filter.
+        """
+        filtered = []
+        kept = list(self.apply(records, filtered))
+        return kept, filtered
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+class BAMHeader:
+    """Metadata read from the header of a BAM file.
+
+    Args:
+        path: BAM file.
+        samples: Distinct SM tags of the read groups, in header order.
+        contigs: Contig names and lengths, in header order.
+
+    Attributes:
+        path (str): BAM file.
+        samples (list[str]): Distinct SM tags of the read groups.
+        contigs (dict[str, int]): Contig names and lengths.
     """
-    Extract SM tag from BAM file.
+
+    def __init__(self, path: str, samples: List[str],
+                 contigs: Dict[str, int]):
+        """Inits a BAMHeader."""
+        self.path = path
+        self.samples = samples
+        self.contigs = contigs
+
+    @property
+    def sample(self) -> str:
+        """str: First SM tag, with a warning if there are several.
+
+        Raises:
+            ValueError: If there is no SM tag.
+        """
+        if not self.samples:
+            raise ValueError(f"SM tag not found: {self.path}")
+
+        if len(self.samples) > 1:
+            logger.warning("Multiple SM tags found (will return the first "
+                           f"one): {self.path}")
+
+        return self.samples[0]
+
+    @property
+    def is_chr(self) -> bool:
+        """bool: True if any contig name contains the 'chr' string."""
+        return any(["chr" in x for x in self.contigs])
+
+    @property
+    def has_index(self) -> bool:
+        """bool: True if an index file exists next to the BAM file.
+
+        This is checked on every access, so it is never stale.
+        """
+        stem = os.path.splitext(self.path)[0]
+        return any([os.path.exists(x) for x in [
+            f"{self.path}.bai", f"{self.path}.csi", f"{stem}.bai"]])
+
+    @classmethod
+    def read(cls, path: str) -> "BAMHeader":
+        """Reads the header of a BAM file."""
+        with pysam.AlignmentFile(path, check_sq=False) as f:
+            header = f.header.to_dict()
+
+        samples = []
+
+        for rg in header.get("RG", []):
+            if "SM" in rg and rg["SM"] not in samples:
+                samples.append(rg["SM"])
+
+        contigs = {x["SN"]: x["LN"] for x in header.get("SQ", [])}
+
+        return cls(path, samples, contigs)
+
+class BAMHeaderCache:
+    """Thread-safe cache of BAM header metadata.
+
+    Entries are keyed by the real path of each BAM file and store its
+    size and modification time, so a modified file is read again and
+    replaces its own entry. If a sidecar file is given, entries are also
+    loaded from and saved to it as JSON, so they are reused across
+    processes. Malformed entries in the sidecar file are ignored, and
+    entries of deleted files are dropped when it is saved.
+
+    Args:
+        filepath: Sidecar JSON file.
+
+    Attributes:
+        filepath (str): Sidecar JSON file.
+    """
+
+    def __init__(self, filepath: Optional[str] = None):
+        """Inits a BAMHeaderCache."""
+        self.filepath = filepath
+        self._lock = threading.Lock()
+        self._entries = {}
+
+        if filepath and os.path.exists(filepath):
+            try:
+                with open(filepath) as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.debug(f"Ignoring unreadable BAM header cache: {e}")
+            else:
+                if isinstance(data, dict):
+                    self._entries = {k: v for k, v in data.items()
+                                     if self._is_entry(v)}
+
+    @staticmethod
+    def _is_entry(entry) -> bool:
+        return (isinstance(entry, dict)
+                and isinstance(entry.get("size"), int)
+                and isinstance(entry.get("mtime_ns"), int)
+                and isinstance(entry.get("samples"), list)
+                and all([isinstance(x, str) for x in entry["samples"]])
+                and isinstance(entry.get("contigs"), dict)
+                and all([isinstance(x, int)
+                         for x in entry["contigs"].values()]))
+
+    def _get(self, path: str) -> Tuple[BAMHeader, bool]:
+        key = os.path.realpath(path)
+        st = os.stat(path)
+        entry = self._entries.get(key)
+        if (entry is not None and entry["size"] == st.st_size
+            and entry["mtime_ns"] == st.st_mtime_ns):
+            return BAMHeader(path, entry["samples"], entry["contigs"]), False
+        header = BAMHeader.read(path)
+        with self._lock:
+            self._entries[key] = {"size": st.st_size,
+                                  "mtime_ns": st.st_mtime_ns,
+                                  "samples": header.samples,
+                                  "contigs": header.contigs}
+        return header, True
+
+    def scan(self, paths: List[str], jobs: int = 8) -> List[BAMHeader]:
+        """Returns the header metadata of BAM files, in order.
+
+        Headers missing from the cache are read by a pool of threads.
+        """
+        if jobs > 1 and len(paths) > 1:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                results = list(executor.map(self._get, paths))
+        else:
+            results = [self._get(x) for x in paths]
+
+        if self.filepath and any([x[1] for x in results]):
+            self.save()
+
+        return [x[0] for x in results]
+
+    def save(self) -> None:
+        """Writes the sidecar file, if any."""
+        dirname = os.path.dirname(os.path.abspath(self.filepath))
+
+        with self._lock:
+            self._entries = {k: v for k, v in self._entries.items()
+                             if os.path.exists(k)}
+            data = json.dumps(self._entries)
+
+        try:
+            fd, temp = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write(data)
+                os.replace(temp, self.filepath)
+            except BaseException:
+                os.remove(temp)
+                raise
+        except OSError as e:
+            logger.debug(f"BAM header cache not saved: {e}")
+
+_bam_headers = BAMHeaderCache(os.environ.get("PYPGX_BAM_HEADER_CACHE"))
+
+def bam_headers(bams: List[str], jobs: int = 8) -> List[BAMHeader]:
+    """
+    Get header metadata of BAM files.
+
+    Results are cached per process, and in the file given by the
+    ``PYPGX_BAM_HEADER_CACHE`` environment variable if it is set.
 
     Returns:
-        str: SM tag.
+        list[BAMHeader]: Header metadata, in order.
 
     Args:
-        bam (str): BAM file.
+        bams (list[str]): BAM files.
+        jobs (int): Number of threads reading headers.
     """
+    return _bam_headers.scan(bams, jobs)
 
-    header = pysam.view("-H", bam).strip().split("\n")
+def bam_header(bam: str) -> BAMHeader:
+    """
+    Get header metadata of BAM file.
 
-    l = []
+    Returns:
+        BAMHeader: Header metadata.
 
-    for line in header:
-        fields = line.split("\t")
-        if "@RG" == fields[0]:
-            for field in fields:
-                if "SM:" in field:
-                    l.append(field.replace("SM:", ""))
+    Args:
+        bam (str): BAM file.
+    """
+    return bam_headers([bam])[0]
 
-    l = list(set(l))
+def sm_tag(bam: str) -> str:
+    """
+    Extract SM tag from BAM file.
 
-    if not l:
-        raise ValueError(f"SM tag not found: {bam}")
+    Returns:
+        str: SM tag.
 
-    if len(l) > 1:
-        logger.warning(
-            f"Multiple SM tags found (will return the first one): {bam}")
-        result = l[0]
-    else:
-        result = l[0]
+    Args:
+        bam (str): BAM file.
+    """
 
-    return result
+    return bam_header(bam).sample
 
 def is_chr(bam: str) -> bool:
     """
@@ -508,23 +1289,165 @@ def is_chr(bam: str) -> bool:
         bam (str): BAM file.
     """
 
-    header = pysam.view("-H", bam).strip().split("\n")
+    return bam_header(bam).is_chr
+
+class TableRegistry:
+    """Process-wide cache of the Stargazer resource tables.
+
+    Tables are loaded from a compiled snapshot (see :mod:`pypgx.snapshot`)
+    when one can be used, so that only the rows of requested genes are
+    materialized; otherwise the text tables are parsed, at most once per
+    process. StarAllele databases are built lazily, once per (gene, genome
+    build) pair. All methods are thread-safe. Returned objects are shared
+    between callers and must be treated as read-only.
+
+    Args:
+        dirpath: Directory containing ``gene_table.txt``, ``snp_table.txt``
+            and ``star_table.txt``.
+        snapshot: If false, always parse the text tables.
+    """
+
+    def __init__(self, dirpath: str, snapshot: bool = True):
+        """Inits a TableRegistry."""
+        self.dirpath = dirpath
+        self.snapshot = snapshot
+        self._lock = threading.RLock()
+        self._source = None
+        self._tables = {}
+        self._stardbs = {}
+
+    def _get_source(self):
+        if self._source is None:
+            with self._lock:
+                if self._source is None:
+                    x = load_snapshot(self.dirpath) if self.snapshot else None
+                    self._source = x if x else False
+        return self._source
+
+    def _get_table(self, name: str):
+        table = self._tables.get(name)
+
+        if table is not None:
+            return table
+
+        with self._lock:
+            if name not in self._tables:
+                source = self._get_source()
+                if source:
+                    i = 0 if name == "snp_table" else 1
+                    table = {}
+                    for gene in source.genes():
+                        rows = source.rows(gene)[i]
+                        if rows is not None:
+                            table[gene] = rows
+                else:
+                    fn = f"{self.dirpath}/{name}.txt"
+                    if name == "snp_table":
+                        table = read_snp_table(fn, self.gene_table())
+                    else:
+                        table = read_star_table(fn)
+                self._tables[name] = table
+
+            return self._tables[name]
+
+    def gene_table(self) -> Dict[str, Dict[str, str]]:
+        """Returns the gene table object."""
+        table = self._tables.get("gene_table")
+
+        if table is not None:
+            return table
+
+        with self._lock:
+            if "gene_table" not in self._tables:
+                source = self._get_source()
+                if source:
+                    table = source.gene_table()
+                else:
+                    table = read_gene_table(
+                        f"{self.dirpath}/gene_table.txt")
+                self._tables["gene_table"] = table
+
+            return self._tables["gene_table"]
+
+    def snp_table(self) -> Dict[str, Dict[str, Dict[str, str]]]:
+        """Returns the SNP table object."""
+        return self._get_table("snp_table")
+
+    def star_table(self) -> Dict[str, Dict[str, Dict[str, str]]]:
+        """Returns the star table object."""
+        return self._get_table("star_table")
+
+    def gene_rows(self, tg: str) -> Tuple[Optional[Dict], Optional[Dict]]:
+        """Returns the SNP and star table rows for the target gene only.
 
-    l = []
+        Either element is None if the gene is absent from that table.
+        """
+        with self._lock:
+            source = self._get_source()
+            if source:
+                return source.rows(tg)
+            return self.snp_table().get(tg), self.star_table().get(tg)
+
+    def stardb(self, tg: str, gb: str) -> Dict[str, StarAllele]:
+        """Returns the StarAllele database for the target gene."""
+        key = (tg, gb)
+        stardb = self._stardbs.get(key)
+
+        if stardb is not None:
+            return stardb
+
+        with self._lock:
+            if key not in self._stardbs:
+                snp_rows, star_rows = self.gene_rows(tg)
+                snp_table = {} if snp_rows is None else {tg: snp_rows}
+                star_table = {} if star_rows is None else {tg: star_rows}
+                snpdb = build_snpdb(tg, gb, snp_table)
+                self._stardbs[key] = build_stardb(
+                    tg, gb, star_table, snpdb)
+
+            return self._stardbs[key]
+
+    def invalidate(self,
+                   tg: Optional[str] = None,
+                   gb: Optional[str] = None) -> None:
+        """Drops cached data so that it is re-read on the next request.
 
-    for line in header:
-        fields = line.split("\t")
-        if "@SQ" == fields[0]:
-            for field in fields:
-                if "SN:" in field:
-                    l.append(field.replace("SN:", ""))
+        Args:
+            tg: If provided, only drop StarAllele databases for this gene.
+            gb: If provided, only drop StarAllele databases for this build.
+        """
+        with self._lock:
+            if tg is None and gb is None:
+                if self._source:
+                    self._source.close()
+                self._source = None
+                self._tables.clear()
+                self._stardbs.clear()
+                return
+
+            for key in list(self._stardbs):
+                if tg in [None, key[0]] and gb in [None, key[1]]:
+                    del self._stardbs[key]
+
+_registry = TableRegistry(f"{os.path.dirname(__file__)}/resources/sg")
+
+def clear_tables(tg: Optional[str] = None, gb: Optional[str] = None) -> None:
+    """
+    Clear cached Stargazer tables.
 
-    return any(["chr" in x for x in l])
+    Args:
+        tg (str, optional): Only clear data for this target gene.
+        gb (str, optional): Only clear data for this genome build.
+    """
+
+    _registry.invalidate(tg, gb)
 
 def get_stardb(tg: str, gb: str) -> Dict[str, StarAllele]:
     """
     Get StarAllele database.
 
+    The database is built once per process and shared between callers.
+
     Returns:
         dict[str, StarAllele]: StarAllele objects.
 
@@ -539,13 +1462,7 @@ def get_stardb(tg: str, gb: str) -> Dict[str, StarAllele]:
         1.0
     """
 
-    p = os.path.dirname(__file__)
-    gene_table = read_gene_table(f"{p}/resources/sg/gene_table.txt")
-    snp_table = read_snp_table(f"{p}/resources/sg/snp_table.txt", gene_table)
-    snpdb = build_snpdb(tg, gb, snp_table)
-    star_table = read_star_table(f"{p}/resources/sg/star_table.txt")
-
-    return build_stardb(tg, gb, star_table, snpdb)
+    return _registry.stardb(tg, gb)
 
 def get_gene_table() -> Dict[str, Dict[str, str]]:
     """
@@ -555,8 +1472,7 @@ def get_gene_table() -> Dict[str, Dict[str, str]]:
         dict[str, dict[str, str]]: Gene table object.
     """
 
-    p = os.path.dirname(__file__)
-    return read_gene_table(f"{p}/resources/sg/gene_table.txt")
+    return _registry.gene_table()
 
 def get_target_genes() -> List[str]:
     """Get the list of target gene names.
@@ -578,13 +1494,92 @@ def get_target_region(tg: str, gb: str) -> str:
         gb (str): Genome build (hg19, hg38).
     """
     gene_table = get_gene_table()
-    target_genes = [k for k, v in gene_table.items() if v["type"] == "target"]
+    target_genes = get_target_genes()
 
     if tg not in target_genes:
         raise ValueError(f"'{tg}' is not among target genes: {target_genes}")
 
     return gene_table[tg][f"{gb}_region"]
 
+def read_genotypes(gt_file: str) -> pd.DataFrame:
+    """Read the main star alleles from a genotype file.
+
+    Returns:
+        pandas.DataFrame: Columns 'hap1_main' and 'hap2_main', indexed by
+        ('gene', 'name').
+
+    Raises:
+        ValueError: If a ('gene', 'name') pair occurs more than once.
+
+    Args:
+        gt_file (str): Genotype file from Stargazer ('genotype.txt').
+    """
+    df = pd.read_csv(gt_file, sep="\t", dtype=str, keep_default_na=False,
+                     usecols=["gene", "name", "hap1_main", "hap2_main"])
+    df = df.set_index(["gene", "name"])[["hap1_main", "hap2_main"]]
+    _check_unique(df, gt_file)
+    return df
+
+def _check_unique(df: pd.DataFrame, name: str) -> None:
+    duplicated = df.index[df.index.duplicated()]
+    if len(duplicated):
+        gene, sample = duplicated[0]
+        raise ValueError(f"Duplicate genotype for gene '{gene}' and sample "
+                         f"'{sample}' in {name}")
+
+def genotype_concordance(truth: pd.DataFrame,
+                         tests: List[pd.DataFrame]) -> pd.DataFrame:
+    """Match the star alleles of test genotypes against the truth.
+
+    Test genotypes are joined to the truth on ('gene', 'name') and the two
+    haplotypes are compared in both orders; the order matching more alleles
+    is kept, so '*4/*1' fully matches '*1/*4'. Truth genotypes absent from
+    a test are counted as unmatched. If there are no tests, the result is
+    empty.
+
+    Returns:
+        pandas.DataFrame: Truth ('hap1_main', 'hap2_main') and test
+        ('hap1_test', 'hap2_test') alleles with 'hap1_match' and
+        'hap2_match' flags for each truth allele, indexed by ('file',
+        'gene', 'name') where 'file' is the position of the test in tests.
+
+    Raises:
+        ValueError: If the truth or a test has more than one genotype for
+        the same ('gene', 'name').
+
+    Args:
+        truth (pandas.DataFrame): Truth genotypes from read_genotypes.
+        tests (list[pandas.DataFrame]): Test genotypes from read_genotypes.
+    """
+    _check_unique(truth, "truth")
+
+    for i, test in enumerate(tests):
+        _check_unique(test, f"test {i}")
+
+    if not tests:
+        index = pd.MultiIndex.from_arrays([[], [], []],
+                                          names=["file", "gene", "name"])
+        columns = ["hap1_main", "hap2_main", "hap1_test", "hap2_test",
+                   "hap1_match", "hap2_match"]
+        return pd.DataFrame(index=index, columns=columns)
+
+    keys = list(range(len(tests)))
+    df = pd.concat([truth] * len(tests), keys=keys, names=["file"])
+    test = pd.concat(tests, keys=keys, names=["file"])
+    test.columns = ["hap1_test", "hap2_test"]
+    df = df.join(test, how="left")
+
+    t1, t2 = df["hap1_main"].values, df["hap2_main"].values
+    s1, s2 = df["hap1_test"].values, df["hap2_test"].values
+    straight = (t1 == s1).astype(int) + (t2 == s2)
+    cross = (t1 == s2).astype(int) + (t2 == s1)
+    swap = cross > straight
+
+    df["hap1_match"] = np.where(swap, t1 == s2, t1 == s1)
+    df["hap2_match"] = np.where(swap, t2 == s1, t2 == s2)
+
+    return df
+
 def get_file_list(
         td: str,
         fe: Optional[str] = None
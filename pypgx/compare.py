@@ -1,71 +1,90 @@
-import copy
 from typing import List
 
-def read_gt(x):
-    genotype = []
-    with open(x) as f:
-        header = next(f).strip().split("\t")
-        i_hap1_main = header.index("hap1_main")
-        i_hap2_main = header.index("hap2_main")
-        for line in f:
-            fields = line.strip().split("\t")
-            hap1_main = fields[i_hap1_main]
-            hap2_main = fields[i_hap2_main]
-            genotype.append([hap1_main, hap2_main])
-    return genotype
-
-def compare(gt_file: List[str], **kwargs) -> str:
+import pandas as pd
+
+from .common import read_genotypes, genotype_concordance
+
+def _format(rows: List[list]) -> str:
+    result = ""
+
+    for l in rows:
+        result += "\t".join([
+            "{0:.4f}".format(x) if isinstance(x, float) else str(x)
+            for x in l]) + "\n"
+
+    return result
+
+def compare(
+        gt_file: List[str],
+        by_gene: bool = False,
+        by_allele: bool = False,
+        **kwargs
+    ) -> str:
     """
     Compare genotype files.
 
+    The first file is the truth. Genotypes are matched by gene and sample
+    name, and each truth allele counts as concordant if the test genotype
+    of the same sample carries it.
+
     Returns:
         str: Result file.
 
     Args:
         gt_file (list[str]): Genotype file.
+        by_gene (bool): Report concordance per gene.
+        by_allele (bool): Report concordance per truth star allele.
     """
 
     truth_file = gt_file[0]
-    truth_genotype = read_gt(truth_file)
-
-    n_total = len(truth_genotype)
-
     test_files = gt_file[1:]
-    test_genotypes = []
-
-    for test_file in test_files:
-        test_genotypes.append(read_gt(test_file))
-
-    data = []
-
-    for test_genotype in test_genotypes:
-        n_incorrect = 0
-        for i in range(n_total):
-            truth = copy.deepcopy(truth_genotype[i])
-            test = test_genotype[i]
-
-            for j in [0, 1]:
-                if test[j] in truth:
-                    truth.remove(test[j])
-
-            n_incorrect += len(truth)
-
-        n_correct = n_total * 2 - n_incorrect
-        p_correct = n_correct / (n_total * 2)
-
-        data.append((n_incorrect, n_correct, p_correct))
+    names = [f"test{i+1}" for i in range(len(test_files))]
+
+    truth = read_genotypes(truth_file)
+    tests = [read_genotypes(x) for x in test_files]
+
+    df = genotype_concordance(truth, tests)
+
+    if by_allele:
+        temp = [["name", "file", "gene", "allele", "disc", "cord", "perc"]]
+        alleles = pd.concat([
+            df[[f"hap{i}_main", f"hap{i}_match"]].set_axis(
+                ["allele", "match"], axis=1)
+            for i in [1, 2]
+        ]).reset_index()
+        alleles["match"] = alleles["match"].astype(int)
+        counts = alleles.groupby(
+            ["file", "gene", "allele"])["match"].agg(["sum", "size"])
+        for (i, gene, allele), n_correct, n in counts.itertuples():
+            temp.append([names[i], test_files[i], gene, allele,
+                         int(n - n_correct), int(n_correct), n_correct / n])
+        return _format(temp)
+
+    df["cord"] = df["hap1_match"].astype(int) + df["hap2_match"]
+
+    if by_gene:
+        temp = [["name", "file", "gene", "disc", "cord", "perc"]]
+        n_total = truth.groupby(level="gene", sort=False).size()
+        for gene, n in n_total.items():
+            temp.append(["truth", truth_file, gene, 0, n * 2, 1.0])
+        cord = df.groupby(level=["file", "gene"], sort=False)["cord"].sum()
+        for (i, gene), n in cord.items():
+            n_correct = int(n)
+            n_incorrect = int(n_total[gene]) * 2 - n_correct
+            temp.append([names[i], test_files[i], gene, n_incorrect,
+                         n_correct, n_correct / (n_total[gene] * 2)])
+        return _format(temp)
+
+    n_total = len(truth)
+    cord = df.groupby(level="file")["cord"].sum()
 
     temp = []
     temp.append(["name", "file", "disc", "cord", "perc"])
     temp.append(["truth", truth_file, 0, n_total * 2, 1.0])
-    for i, x in enumerate(data):
-        temp.append([f"test{i+1}", test_files[i], x[0], x[1], x[2]])
-
-    result = ""
-
-    for l in temp:
-        result += "\t".join([
-            "{0:.4f}".format(x) if isinstance(x, float) else str(x)
-            for x in l]) + "\n"
+    for i, test_file in enumerate(test_files):
+        n_correct = int(cord.get(i, 0))
+        n_incorrect = n_total * 2 - n_correct
+        p_correct = n_correct / (n_total * 2)
+        temp.append([names[i], test_file, n_incorrect, n_correct, p_correct])
 
-    return result
\ No newline at end of file
+    return _format(temp)
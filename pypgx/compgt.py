@@ -1,3 +1,7 @@
+import pandas as pd
+
+from .common import read_genotypes
+
 def compgt(
         truth_file: str,
         test_file: str,
@@ -6,6 +10,10 @@ def compgt(
     ) -> str:
     """Compute the concordance between two genotype files.
 
+    Genotypes are matched by gene and sample name, so the files may
+    contain any number of genes. Truth samples missing from the sample map
+    or the test file are reported with 'NA'.
+
     Returns:
         str: Genotype concordance.
 
@@ -27,51 +35,20 @@ def compgt(
             name2 = fields[1]
             mapping[name1] = name2
 
-    target_gene = ""
-
-    truth_data = {}
-
-    with open(truth_file) as f:
-        next(f)
-        for line in f:
-            fields = line.strip().split("\t")
-            gene = fields[0]
-            name = fields[1]
-            hap1_main = fields[3]
-            hap2_main = fields[4]
-
-            if not target_gene:
-                target_gene = gene
-
-            if target_gene != gene:
-                raise ValueError("More than one target genes detected")
-
-            genotype = hap1_main + "/" + hap2_main
-            truth_data[name] = genotype
-
-    test_data = {}
-
-    with open(test_file) as f:
-        next(f)
-        for line in f:
-            fields = line.strip().split("\t")
-            gene = fields[0]
-            name = fields[1]
-            hap1_main = fields[3]
-            hap2_main = fields[4]
-
-            if target_gene != gene:
-                raise ValueError("More than one target genes detected")
-
-            genotype = hap1_main + "/" + hap2_main
-            test_data[name] = genotype
+    truth = read_genotypes(truth_file).reset_index()
+    test = read_genotypes(test_file)
 
-    result = ""
+    df = pd.DataFrame({
+        "gene": truth["gene"],
+        "name1": truth["name"],
+        "genotype1": truth["hap1_main"] + "/" + truth["hap2_main"],
+        "name2": truth["name"].map(mapping),
+    })
 
-    for name1, genotype1 in truth_data.items():
-        name2 = mapping[name1]
-        genotype2 = test_data[name2]
-        fields = [target_gene, name1, genotype1, name2, genotype2, genotype1==genotype2]
-        result += "\t".join([str(x) for x in fields]) + "\n"
+    test = test["hap1_main"] + "/" + test["hap2_main"]
+    keys = pd.MultiIndex.from_arrays([df["gene"], df["name2"]])
+    df["genotype2"] = test.reindex(keys).values
+    df["equal"] = df["genotype1"] == df["genotype2"]
+    df = df.fillna("NA")
 
-    return result
\ No newline at end of file
+    return df.to_csv(sep="\t", header=False, index=False)
@@ -1,8 +1,213 @@
-from .common import get_logger, VCFFile
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .sglib import parse_region
+from .common import (
+    get_logger,
+    get_gene_table,
+    get_target_genes,
+    VCFFile,
+    Record,
+    GenotypeMatrix,
+    FilterPipeline,
+    MultiallelicFilter,
+    MissingFilter,
+)
+
+def _snp_key(record: Record) -> Tuple[str, int, str, str]:
+    return (record.chrom, record.pos, record.ref, record.alt[0])
+
+def join_records(records1: List[Record],
+                 records2: List[Record]) -> Tuple[List[int], List[int]]:
+    """Match records of two VCFs by (CHROM, POS, REF, first ALT).
+
+    Records are matched with a hash join, in the order of the first list.
+    Duplicate keys are paired in order of appearance.
+
+    Returns:
+        Indices of the matched records in each list.
+
+    Args:
+        records1: Records of the first VCF.
+        records2: Records of the second VCF.
+    """
+    table = {}
+
+    for i, record in enumerate(records2):
+        table.setdefault(_snp_key(record), []).append(i)
+
+    index1 = []
+    index2 = []
+    seen = {}
+
+    for i, record in enumerate(records1):
+        key = _snp_key(record)
+        if key not in table:
+            continue
+        n = seen.get(key, 0)
+        if n < len(table[key]):
+            index1.append(i)
+            index2.append(table[key][n])
+        seen[key] = n + 1
+
+    return index1, index2
+
+def concordance_counts(records1: List[Record],
+                       records2: List[Record],
+                       columns1: List[int],
+                       columns2: List[int],
+                       chunk_size: int = 10000) -> Dict[str, np.ndarray]:
+    """Count genotype agreement between paired records and samples.
+
+    Alternative allele counts are compared for all sample pairs at once,
+    one chunk of records at a time. Each pair of genotypes is a true
+    negative (both 0), true positive (equal and non-zero), false negative
+    (first greater) or false positive (first smaller).
+
+    Returns:
+        Counts with shape (4, pairs) for 'snv' and 'indel', with rows in
+        the order tn, tp, fn, fp.
+
+    Args:
+        records1: Records of the first (truth) VCF.
+        records2: Records of the second (test) VCF, paired with records1.
+        columns1: 0-based sample indices in the first VCF.
+        columns2: 0-based sample indices in the second VCF, paired with
+            columns1.
+        chunk_size: Number of records per chunk.
+    """
+    counts = {x: np.zeros((4, len(columns1)), dtype=np.int64)
+              for x in ["snv", "indel"]}
+
+    for start in range(0, len(records1), chunk_size):
+        chunk1 = records1[start:start + chunk_size]
+        chunk2 = records2[start:start + chunk_size]
+        gt1 = GenotypeMatrix.from_records(chunk1, columns=columns1).gt
+        gt2 = GenotypeMatrix.from_records(chunk2, columns=columns2).gt
+        ac1 = gt1.clip(min=0).sum(axis=2)
+        ac2 = gt2.clip(min=0).sum(axis=2)
+        table = np.stack([
+            (ac1 == 0) & (ac2 == 0),
+            (ac1 == ac2) & (ac1 != 0),
+            ac1 > ac2,
+            ac1 < ac2,
+        ])
+        snv = np.array([len(x.ref) == 1 and len(x.alt[0]) == 1
+                        for x in chunk1], dtype=bool)
+        counts["snv"] += table[:, snv].sum(axis=1)
+        counts["indel"] += table[:, ~snv].sum(axis=1)
+
+    return counts
+
+def read_strata(strata: str,
+                genome_build: str = "hg19") -> List[Tuple[str, int, int, str]]:
+    """Read the intervals defining concordance strata.
+
+    Returns:
+        Intervals as (chrom, start, end, name) with 1-based, inclusive
+        coordinates and chromosome names without the 'chr' prefix.
+
+    Args:
+        strata: 'genes' to use the regions of the target genes in the gene
+            table, or a BED file. The fourth BED column, if present, is
+            used as the stratum name.
+        genome_build: Genome build ('hg19' or 'hg38'), used with 'genes'.
+    """
+    result = []
+
+    if strata == "genes":
+        gene_table = get_gene_table()
+        for gene in get_target_genes():
+            region = gene_table[gene][f"{genome_build}_region"]
+            chrom, start, end = parse_region(region, omit=True)
+            result.append((chrom, start, end, gene))
+        return result
+
+    with open(strata) as f:
+        for line in f:
+            if not line.strip() or line.startswith(("#", "track", "browser")):
+                continue
+            fields = line.strip().split("\t")
+            chrom = fields[0].replace("chr", "")
+            start = int(fields[1]) + 1
+            end = int(fields[2])
+            if len(fields) > 3:
+                name = fields[3]
+            else:
+                name = f"{fields[0]}:{start}-{end}"
+            result.append((chrom, start, end, name))
+
+    return result
+
+def assign_strata(records: List[Record],
+                  intervals: List[Tuple[str, int, int, str]]
+                  ) -> Dict[str, np.ndarray]:
+    """Assign records to the strata containing them.
+
+    Record positions are sorted once per chromosome and the records within
+    each interval are found by binary search. A record may belong to more
+    than one stratum if intervals overlap.
+
+    Returns:
+        Sorted indices of the records in each stratum, in the order in
+        which strata first appear in intervals.
+
+    Args:
+        records: Records without the 'chr' prefix (see VCFFile.read).
+        intervals: Intervals as returned by :func:`read_strata`.
+    """
+    chroms = {}
+
+    for i, record in enumerate(records):
+        chroms.setdefault(record.chrom, []).append((record.pos, i))
+
+    for chrom, items in chroms.items():
+        items = np.array(items, dtype=np.int64).reshape(-1, 2)
+        items = items[np.argsort(items[:, 0], kind="stable")]
+        chroms[chrom] = (items[:, 0], items[:, 1])
+
+    members = {}
+
+    for chrom, start, end, name in intervals:
+        members.setdefault(name, [])
+        if chrom not in chroms:
+            continue
+        positions, index = chroms[chrom]
+        lo = np.searchsorted(positions, start, side="left")
+        hi = np.searchsorted(positions, end, side="right")
+        members[name].append(index[lo:hi])
+
+    return {k: np.unique(np.concatenate(v)) if v else np.array([], dtype=int)
+            for k, v in members.items()}
+
+# Records shared with worker processes; see _init_worker.
+_shared = None
+
+def _init_worker(records1, records2, groups):
+    global _shared
+    _shared = (records1, records2, groups)
+
+def _count_groups(records1, records2, groups, columns1, columns2):
+    if groups is None:
+        return [concordance_counts(records1, records2, columns1, columns2)]
+    result = []
+    for index in groups:
+        result.append(concordance_counts(
+            [records1[i] for i in index], [records2[i] for i in index],
+            columns1, columns2))
+    return result
+
+def _count_worker(columns1, columns2):
+    return _count_groups(*_shared, columns1, columns2)
 
 def compvcf(truth_file: str,
             test_file: str,
             sample_map: str,
+            strata: Optional[str] = None,
+            genome_build: str = "hg19",
+            jobs: int = 1,
             **kwargs) -> str:
     """Compute the concordance between two VCF files.
 
@@ -14,6 +219,10 @@ def compvcf(truth_file: str,
         test_file: Test VCF file.
         sample_map: Tab-delimited text file with two columns representing
             the truth and test sample names.
+        strata: If provided, report concordance per stratum, which is
+            either 'genes' (target genes) or a BED file.
+        genome_build: Genome build ('hg19' or 'hg38'), used with 'genes'.
+        jobs: Number of processes over which sample pairs are distributed.
     """
 
     logger = get_logger()
@@ -25,102 +234,96 @@ def compvcf(truth_file: str,
             fields = line.strip().split("\t")
             mapping.append((fields[0], fields[1]))
 
-    vcf1 = VCFFile(truth_file)
-    vcf1.read(tidy=True)
-    logger.info("Truth VCF")
-    logger.info(f"    # SNPs: {len(vcf1.data)}")
-    vcf1.multiallelic_filter()
-    logger.info(f"    # SNPs after multiallelic filter: {len(vcf1.data)}")
-    vcf1.missing_filter()
-    logger.info(f"    # SNPs after missing filter: {len(vcf1.data)}")
-
-    vcf2 = VCFFile(test_file)
-    vcf2.read(tidy=True)
-    logger.info("Test VCF")
-    logger.info(f"    # SNPs: {len(vcf2.data)}")
-    vcf2.multiallelic_filter()
-    logger.info(f"    # SNPs after multiallelic filter: {len(vcf2.data)}")
-    vcf2.missing_filter()
-    logger.info(f"    # SNPs after missing filter: {len(vcf2.data)}")
-
-    snp1 = ["{}:{}:{}:{}".format(x.chrom, x.pos, x.ref, x.alt[0])
-            for x in vcf1.data]
-    snp2 = ["{}:{}:{}:{}".format(x.chrom, x.pos, x.ref, x.alt[0])
-            for x in vcf2.data]
-
-    overlapping = sorted(list(set(snp1) & set(snp2)))
+    vcfs = []
+
+    for label, vcf_file in [("Truth", truth_file), ("Test", test_file)]:
+        vcf = VCFFile(vcf_file)
+        pipeline = FilterPipeline([MultiallelicFilter(), MissingFilter()])
+        vcf.data = list(pipeline.apply(vcf.iter_records(tidy=True)))
+        n = pipeline.total
+        logger.info(f"{label} VCF")
+        logger.info(f"    # SNPs: {n}")
+        n -= pipeline.counts["MultiallelicFilter"]
+        logger.info(f"    # SNPs after multiallelic filter: {n}")
+        n -= pipeline.counts["MissingFilter"]
+        logger.info(f"    # SNPs after missing filter: {n}")
+        vcfs.append(vcf)
+
+    vcf1, vcf2 = vcfs
+
+    index1, index2 = join_records(vcf1.data, vcf2.data)
+
+    overlapping = set([_snp_key(vcf1.data[i]) for i in index1])
 
     logger.info(f"# SNPs overlapping: {len(overlapping)}")
 
-    for i in reversed(range(len(vcf1.data))):
-        v = vcf1.data[i]
-        x = "{}:{}:{}:{}".format(v.chrom, v.pos, v.ref, v.alt[0])
-        if x not in overlapping:
-            del vcf1.data[i]
+    columns1 = [vcf1.header.index(x[0]) - 9 for x in mapping]
+    columns2 = [vcf2.header.index(x[1]) - 9 for x in mapping]
 
-    for i in reversed(range(len(vcf2.data))):
-        v = vcf2.data[i]
-        x = "{}:{}:{}:{}".format(v.chrom, v.pos, v.ref, v.alt[0])
-        if x not in overlapping:
-            del vcf2.data[i]
+    records1 = [vcf1.data[i] for i in index1]
+    records2 = [vcf2.data[i] for i in index2]
 
-    dat = []
+    if strata is None:
+        names = [None]
+        groups = None
+    else:
+        members = assign_strata(records1, read_strata(strata, genome_build))
+        names = list(members)
+        groups = list(members.values())
+        logger.info(f"# Strata: {len(names)}")
+
+    # Sample pairs are split into one chunk per job.
+    chunks = np.array_split(np.arange(len(mapping)), max(1, jobs))
+    chunks = [x.tolist() for x in chunks if len(x)]
+    args = ([[columns1[i] for i in x] for x in chunks],
+            [[columns2[i] for i in x] for x in chunks])
+
+    if jobs > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(
+            max_workers=len(chunks), initializer=_init_worker,
+            initargs=(records1, records2, groups)
+        ) as executor:
+            results = list(executor.map(_count_worker, *args))
+    else:
+        results = [_count_groups(records1, records2, groups, *x)
+                   for x in zip(*args)]
+
+    # Concatenate the pair chunks of each stratum.
+    counts = [{k: np.concatenate([x[i][k] for x in results], axis=1)
+               for k in ["snv", "indel"]} for i in range(len(names))]
 
     def f(x):
         tn, tp, fn, fp = x
-        con = (tn + tp) / (tn + tp + fn + fp)
         # Sensitivity, recall, hit rate, or true positive rate (TPR).
-        tpr = tp / (tp + fn)
         # Specificity, selectivity or true negative rate (TNR).
-        tnr = tn / (tn + fp)
-        return ["{:.4f}".format(x) for x in [tpr, tnr, con]]
-
-    for i in range(len(mapping)):
-        name1 = mapping[i][0]
-        name2 = mapping[i][1]
-
-        x1 = vcf1.header.index(name1)
-        x2 = vcf2.header.index(name2)
+        rates = [(tp, tp + fn), (tn, tn + fp), (tn + tp, tn + tp + fn + fp)]
+        return ["{:.4f}".format(x / y) if y else "NA" for x, y in rates]
 
-        # tn, tp, fn, fp
-        counts = {"snv": [0, 0, 0, 0],
-                  "indel": [0, 0, 0, 0]}
+    dat = []
 
-        for j in range(len(vcf1.data)):
-            v1 = vcf1.data[j]
-            v2 = vcf2.data[j]
+    for i, (name1, name2) in enumerate(mapping):
+        for name, x in zip(names, counts):
+            snv = x["snv"][:, i].tolist()
+            indel = x["indel"][:, i].tolist()
+            all = [x + y for x, y in zip(snv, indel)]
 
-            if len(v1.ref) == 1 and len(v1.alt[0]) == 1:
-                type = "snv"
-            else:
-                type = "indel"
+            row = [name1, name2]
 
-            ac1 = sum([int(x) for x in v1.fields[x1].split(":")[0].replace(
-                "|", "/").split("/")])
-            ac2 = sum([int(x) for x in v2.fields[x2].split(":")[0].replace(
-                "|", "/").split("/")])
+            if strata is not None:
+                row.append(name)
 
-            if ac1 == ac2 == 0:
-                counts[type][0] += 1
-            elif ac1 == ac2:
-                counts[type][1] += 1
-            elif ac1 > ac2:
-                counts[type][2] += 1
-            elif ac1 < ac2:
-                counts[type][3] += 1
+            row += snv + f(snv) + indel + f(indel) + all + f(all)
 
-        snv = counts["snv"]
-        indel = counts["indel"]
-        all = [x + y for x, y in zip(counts["snv"], counts["indel"])]
+            dat.append(row)
 
-        row = [name1, name2] + snv + f(snv) + indel + f(indel) + all + f(all)
+    result = ""
 
-        dat.append(row)
+    headers = ["name1", "name2"]
 
-    result = ""
+    if strata is not None:
+        headers.append("stratum")
 
-    headers = ["name1", "name2",
-               "snv_tn", "snv_tp", "snv_fn", "snv_fp",
+    headers += ["snv_tn", "snv_tp", "snv_fn", "snv_fp",
                "snv_tpr", "snv_tnr", "snv_con",
                "indel_tn", "indel_tp", "indel_fn", "indel_fp",
                "indel_tpr", "indel_tnr", "indel_con",
@@ -0,0 +1,340 @@
+import os
+import hashlib
+import tempfile
+import zipfile
+from typing import List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pysam
+
+from .sglib import parse_region
+
+# Reads ignored by samtools depth by default: UNMAP, SECONDARY, QCFAIL, DUP.
+EXCLUDE_FLAGS = 0x704
+
+# Size of the BAM index linear bins; parallel windows are aligned to it.
+WINDOW_ALIGN = 16384
+
+def read_depth(
+        bam_file: str,
+        contig: str,
+        start: int,
+        end: int,
+        min_mapq: int = 0,
+        exclude_flags: int = EXCLUDE_FLAGS
+    ) -> np.ndarray:
+    """Compute the per-base read depth of a BAM file.
+
+    The result matches ``samtools depth -a``: only aligned bases are
+    counted (deletions and reference skips are not), and reads with any
+    of exclude_flags set or a mapping quality below min_mapq are ignored.
+
+    Returns:
+        numpy.ndarray: Read depth (int32) of each position.
+
+    Args:
+        bam_file: BAM file, which must be indexed.
+        contig: Contig name as it appears in the BAM header.
+        start: 1-based start position.
+        end: 1-based end position (inclusive).
+        min_mapq: Minimum mapping quality.
+        exclude_flags: Ignore reads with any of these flags set.
+    """
+    n = max(end - start + 1, 0)
+    offset = start - 1
+    starts = []
+    ends = []
+
+    with pysam.AlignmentFile(bam_file) as f:
+        if n and contig in f.references:
+            for read in f.fetch(contig, offset, end):
+                if (read.flag & exclude_flags
+                    or read.mapping_quality < min_mapq):
+                    continue
+                for x, y in read.get_blocks():
+                    starts.append(x)
+                    ends.append(y)
+
+    # Blocks are added to a difference array, clipped to the region.
+    starts = np.clip(np.array(starts, dtype=np.int64) - offset, 0, n)
+    ends = np.clip(np.array(ends, dtype=np.int64) - offset, 0, n)
+    diff = (np.bincount(starts, minlength=n + 1)
+            - np.bincount(ends, minlength=n + 1))
+
+    return np.cumsum(diff[:n]).astype(np.int32)
+
+def _resolve_region(bam_files: List[str],
+                    region: str) -> Tuple[str, int, int]:
+    contig, start, end = parse_region(region)
+
+    for bam_file in bam_files:
+        with pysam.AlignmentFile(bam_file) as f:
+            if contig in f.references:
+                end = min(end, f.get_reference_length(contig))
+                break
+
+    return contig, start, end
+
+def _windows(start: int, end: int, jobs: int) -> List[Tuple[int, int]]:
+    # Split a region into about four windows per job, with boundaries on
+    # multiples of WINDOW_ALIGN so each window starts at an index bin.
+    size = max(end - start + 1, 0) // (jobs * 4)
+    size = max(1, -(-size // WINDOW_ALIGN)) * WINDOW_ALIGN
+    result = []
+    x = start
+    while x <= end:
+        y = min((x - 1) // size * size + size, end)
+        result.append((x, y))
+        x = y + 1
+    return result
+
+def _read_depth(args) -> np.ndarray:
+    return read_depth(*args)
+
+class DepthCache:
+    """On-disk cache of read depth, stored per BAM file in fixed chunks.
+
+    Each chunk holds the depth of CHUNK_SIZE positions of one BAM file as
+    a compressed NumPy file. Files are content-addressed: their name is a
+    hash of the BAM file's real path, size and modification time, the
+    chunk coordinates and the read filters, so a modified BAM file never
+    reuses stale entries and different genes share chunks of the same
+    region.
+
+    Args:
+        cache_dir: Cache directory (created if missing).
+
+    Attributes:
+        cache_dir (str): Cache directory.
+    """
+
+    CHUNK_SIZE = WINDOW_ALIGN * 4
+    VERSION = 1
+
+    # Regions shorter than this are not worth reading a whole chunk for.
+    MIN_REGION = CHUNK_SIZE // 4
+
+    def __init__(self, cache_dir: str):
+        """Inits a DepthCache."""
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def chunks(self, start: int, end: int) -> List[Tuple[int, int]]:
+        """Returns the chunks (1-based, inclusive) overlapping a region."""
+        n = self.CHUNK_SIZE
+        return [(i * n + 1, i * n + n)
+                for i in range((start - 1) // n, (end - 1) // n + 1)]
+
+    def _path(self, bam_file, contig, start, end, min_mapq) -> str:
+        st = os.stat(bam_file)
+        key = repr((self.VERSION, os.path.realpath(bam_file), st.st_size,
+                    st.st_mtime_ns, contig, start, end, min_mapq,
+                    EXCLUDE_FLAGS))
+        name = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.cache_dir, name[:2], f"{name}.npz")
+
+    def load(self, bam_file: str, contig: str, start: int, end: int,
+             min_mapq: int) -> Optional[np.ndarray]:
+        """Returns the cached depth of a chunk, or None if missing."""
+        try:
+            with np.load(self._path(bam_file, contig, start, end,
+                                    min_mapq)) as f:
+                return f["depth"]
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return None
+
+    def save(self, bam_file: str, contig: str, start: int, end: int,
+             min_mapq: int, depth: np.ndarray) -> None:
+        """Stores the depth of a chunk."""
+        path = self._path(bam_file, contig, start, end, min_mapq)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, depth=depth)
+            os.replace(temp, path)
+        except BaseException:
+            os.remove(temp)
+            raise
+
+def bam_depths(
+        bam_files: List[str],
+        regions: List[str],
+        min_mapq: int = 0,
+        jobs: int = 1,
+        cache_dir: Optional[str] = None
+    ) -> List[Tuple[str, int, np.ndarray]]:
+    """Compute the read depth of BAM files over regions.
+
+    Each region is clipped to the contig length in the first BAM file
+    containing the contig. With more than one job, each region is split
+    into windows aligned to the BAM index bins and the depth of every
+    (window, BAM file) pair is computed in a process pool. The results are
+    stitched back in order, so they do not depend on jobs, and a single
+    deep BAM file benefits from parallelism as much as many small ones.
+
+    With a cache directory, the depth of regions of at least
+    ``DepthCache.MIN_REGION`` positions is computed in the chunks of a
+    :class:`DepthCache`; chunks already in the cache are loaded and only
+    the missing ones are computed (and then stored). Shorter regions are
+    computed directly.
+
+    Each window is copied into the regions it overlaps as soon as it is
+    loaded or computed and then dropped, so memory usage is about the
+    size of the result.
+
+    Returns:
+        list[tuple]: Contig, 1-based start position and read depth (int32)
+        with shape (positions, samples) for each region.
+
+    Args:
+        bam_files: BAM files, which must be indexed.
+        regions: Regions (e.g. 'chr22:42512500-42551883').
+        min_mapq: Minimum mapping quality.
+        jobs: Number of processes.
+        cache_dir: Cache directory.
+    """
+    cache = None if cache_dir is None else DepthCache(cache_dir)
+    result = []
+    # Each task is the depth of a window in a BAM file, which may fill
+    # parts of more than one region.
+    plan = {}
+    cached = set()
+
+    for region in regions:
+        contig, start, end = _resolve_region(bam_files, region)
+        depth = np.zeros((max(end - start + 1, 0), len(bam_files)),
+                         dtype=np.int32)
+        result.append((contig, start, depth))
+
+        use_cache = (cache is not None
+                     and end - start + 1 >= cache.MIN_REGION)
+
+        if start > end:
+            continue
+        elif use_cache:
+            windows = cache.chunks(start, end)
+        elif jobs > 1:
+            windows = _windows(start, end, jobs)
+        else:
+            windows = [(start, end)]
+
+        for x, y in windows:
+            for i, bam_file in enumerate(bam_files):
+                task = (bam_file, contig, x, y, min_mapq)
+                plan.setdefault(task, []).append((depth, i, start, end))
+                if use_cache:
+                    cached.add(task)
+
+    def fill(task, column):
+        x, y = task[2], task[3]
+        for depth, i, start, end in plan.pop(task):
+            a, b = max(x, start), min(y, end)
+            depth[a - start:b - start + 1, i] = column[a - x:b - x + 1]
+
+    todo = []
+
+    for task in list(plan):
+        column = cache.load(*task) if task in cached else None
+        if column is None:
+            todo.append(task)
+        else:
+            fill(task, column)
+
+    def finish(task, column):
+        if task in cached:
+            cache.save(*task, column)
+        fill(task, column)
+
+    if jobs > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for task, column in zip(todo, executor.map(_read_depth, todo)):
+                finish(task, column)
+    else:
+        for task in todo:
+            finish(task, _read_depth(task))
+
+    return result
+
+def bed_regions(bed_file: str, bam_file: str) -> List[str]:
+    """Read the regions of a BED file as samtools depth would visit them.
+
+    Overlapping and adjacent intervals are merged, and regions are sorted
+    by the order of contigs in the BAM header and then by position.
+    Contigs absent from the BAM header are ignored.
+
+    Returns:
+        list[str]: Regions with 1-based, inclusive coordinates.
+
+    Args:
+        bed_file: BED file.
+        bam_file: BAM file providing the contig order.
+    """
+    with pysam.AlignmentFile(bam_file) as f:
+        contigs = list(f.references)
+
+    intervals = {}
+
+    with open(bed_file) as f:
+        for line in f:
+            if not line.strip() or line.startswith(("#", "track", "browser")):
+                continue
+            fields = line.strip().split("\t")
+            intervals.setdefault(fields[0], []).append(
+                (int(fields[1]) + 1, int(fields[2])))
+
+    result = []
+
+    for contig in contigs:
+        merged = []
+        for start, end in sorted(intervals.get(contig, [])):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        result += [f"{contig}:{x}-{y}" for x, y in merged]
+
+    return result
+
+def bam_depth(
+        bam_files: List[str],
+        region: str,
+        min_mapq: int = 0
+    ) -> Tuple[str, int, np.ndarray]:
+    """Compute the read depth of BAM files over a region.
+
+    See :func:`bam_depths` for details.
+
+    Returns:
+        tuple: Contig, 1-based start position and read depth (int32) with
+        shape (positions, samples).
+
+    Args:
+        bam_files: BAM files, which must be indexed.
+        region: Region (e.g. 'chr22:42512500-42551883').
+        min_mapq: Minimum mapping quality.
+    """
+    return bam_depths(bam_files, [region], min_mapq)[0]
+
+def format_sdf(contig: str, start: int, depth: np.ndarray) -> str:
+    """Format read depth as SDF (``samtools depth`` format) lines.
+
+    Returns:
+        str: SDF lines.
+
+    Args:
+        contig: Contig name.
+        start: 1-based position of the first row.
+        depth: Read depth with shape (positions, samples).
+    """
+    n = depth.shape[0]
+
+    if not n:
+        return ""
+
+    columns = [[contig] * n, np.arange(start, start + n).astype(str).tolist()]
+    columns += [x.astype(str).tolist() for x in depth.T]
+
+    return "\n".join(map("\t".join, zip(*columns))) + "\n"
@@ -1,4 +1,6 @@
-from .phenotyper import phenotyper
+import pandas as pd
+
+from .phenotyper import phenotyper, phenotyper_batch
 
 def gt2pt(gt_file: str,
           **kwargs) -> str:
@@ -13,21 +15,9 @@ def gt2pt(gt_file: str,
         gt_file (str): Genotype file from Stargazer (``genotype.txt``).
     """
 
-    result = []
-
-    with open(gt_file) as f:
-        header = next(f).strip().split("\t")
-
-        i1 = header.index("gene")
-        i2 = header.index("hap1_main")
-        i3 = header.index("hap2_main")
-
-        for line in f:
-            fields = line.strip().split("\t")
-            gene = fields[i1]
-            hap1 = fields[i2]
-            hap2 = fields[i3]
+    df = pd.read_csv(gt_file, sep="\t", dtype=str, keep_default_na=False,
+                     usecols=["gene", "hap1_main", "hap2_main"])
 
-            result.append(phenotyper(gene, hap1, hap2))
+    result = phenotyper_batch(df["gene"], df["hap1_main"], df["hap2_main"])
 
-    return "\n".join(result) + "\n"
\ No newline at end of file
+    return "\n".join(result) + "\n"
@@ -1,18 +1,35 @@
+from io import StringIO
+from typing import List, Optional, Union
+
 from .common import VCFFile
 
 def minivcf(vcf_file: str,
-            region: str,
-            **kwargs) -> str:
+            region: Union[str, List[str]],
+            output: Optional[str] = None,
+            **kwargs) -> Optional[str]:
     """Slice VCF file.
 
+    Records are streamed from the input to the output, so memory usage
+    does not depend on the size of the VCF file. If the input is bgzipped
+    and indexed with tabix (.tbi) or CSI (.csi), only the blocks that
+    overlap the requested regions are read.
+
     Returns:
-        VCF data in text.
+        VCF data in text, unless ``output`` is provided.
 
     Args:
         vcf_file: VCF file.
-        region: Target region.
+        region: Target region(s).
+        output: If provided, write VCF data to this file instead.
     """
 
     vcf = VCFFile(vcf_file)
-    vcf.read(region)
-    return vcf.to_str()
+    records = vcf.iter_records(region)
+
+    if output:
+        vcf.to_file(output, records)
+        return None
+
+    f = StringIO()
+    vcf.write(f, records)
+    return f.getvalue()
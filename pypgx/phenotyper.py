@@ -1,106 +1,101 @@
-from .common import get_stardb
+import bisect
+from functools import lru_cache
+from typing import Sequence, Tuple
 
-def _phenotype_default(stardb, hap1, hap2):
-    as1 = _hap2as(stardb, hap1)
-    as2 = _hap2as(stardb, hap2)
-    total = as1 + as2
-    if total < 0:
-        result = "unknown_function"
-    elif total == 0:
-        result = "no_function"
-    elif 0 < total < 2:
-        result = "decreased_function"
-    elif total == 2:
-        result = "normal_function"
-    elif total > 2:
-        result = "increased_function"
-    else:
-        result = "undetermined_function"
-    return result
+import numpy as np
+import pandas as pd
 
-def _metabolizer_default(stardb, hap1, hap2):
-    as1 = _hap2as(stardb, hap1)
-    as2 = _hap2as(stardb, hap2)
-    total = as1 + as2
-    if total < 0:
-        result = "unknown_metabolizer"
-    elif total == 0:
-        result = "poor_metabolizer"
-    elif 0 < total <= 1.25:
-        result = "intermediate_metabolizer"
-    elif 1.25 < total <= 2:
-        result = "normal_metabolizer"
-    elif 2 < total < 2.5:
-        result = "rapid_metabolizer"
-    elif total >= 2.5:
-        result = "ultrarapid_metabolizer"
-    else:
-        result = "undetermined_metabolizer"
-    return result
+from .common import get_stardb
 
-def _metabolizer_cyp2d6(stardb, hap1, hap2):
-    as1 = _hap2as(stardb, hap1)
-    as2 = _hap2as(stardb, hap2)
-    total = as1 + as2
-    if total < 0:
-        result = "unknown_metabolizer"
-    elif total == 0:
-        result = "poor_metabolizer"
-    elif 0 < total <= 1:
-        result = "intermediate_metabolizer"
-    elif 1 < total <= 2.25:
-        result = "normal_metabolizer"
-    elif total > 2.25:
-        result = "ultrarapid_metabolizer"
-    else:
-        result = "undetermined_metabolizer"
-    return result
+class _Ladder:
+    """Phenotyping algorithm defined by activity score cut points.
 
-def _metabolizer_dpyd(stardb, hap1, hap2):
-    as1 = _hap2as(stardb, hap1)
-    as2 = _hap2as(stardb, hap2)
-    total = as1 + as2
-    if total < 0:
-        result = "unknown_metabolizer"
-    elif 0 <= total <= 0.5:
-        result = "poor_metabolizer"
-    elif 0.5 < total < 2:
-        result = "intermediate_metabolizer"
-    elif total == 2:
-        result = "normal_metabolizer"
-    elif total > 2:
-        result = "ultrarapid_metabolizer"
-    else:
-        result = "undetermined_metabolizer"
-    return result
+    Args:
+        labels: Phenotypes from the lowest to the highest bin. The first
+            bin holds scores below the first cut point.
+        cuts: Pairs of (score, inclusive), one per bin after the first. The
+            bin starts at the score and includes it if inclusive is true.
+        undetermined: Phenotype for scores that fall into no bin (NaN).
+    """
 
-def _transporter_default(stardb, hap1, hap2):
-    as1 = _hap2as(stardb, hap1)
-    as2 = _hap2as(stardb, hap2)
-    total = as1 + as2
-    if total < 0:
-        result = "unknown_function"
-    elif 0 <= total <= 1:
-        result = "poor_function"
-    elif 1 < total <= 1.5:
-        result = "decreased_function"
-    elif 1.5 < total <= 2:
-        result = "normal_function"
-    elif 2 < total:
-        result = "increased_function"
-    else:
-        result = "undetermined_function"
-    return result
+    def __init__(self, labels, cuts, undetermined):
+        self.labels = labels
+        self.cuts = cuts
+        self.undetermined = undetermined
+        self.incl = [x for x, y in cuts if y]
+        self.excl = [x for x, y in cuts if not y]
+        self._labels = np.array(labels + [undetermined], dtype=object)
+
+    def classify(self, total: float) -> str:
+        """Returns the phenotype for a total activity score."""
+        if total != total:
+            return self.undetermined
+        i = (bisect.bisect_right(self.incl, total) +
+             bisect.bisect_left(self.excl, total))
+        return self.labels[i]
+
+    def classify_array(self, totals: np.ndarray) -> np.ndarray:
+        """Returns the phenotypes for an array of total activity scores."""
+        i = (np.searchsorted(self.incl, totals, side="right") +
+             np.searchsorted(self.excl, totals, side="left"))
+        i[np.isnan(totals)] = len(self.labels)
+        return self._labels[i]
+
+    def __call__(self, stardb, hap1, hap2):
+        return self.classify(_hap2as(stardb, hap1) + _hap2as(stardb, hap2))
+
+_phenotype_default = _Ladder(
+    ["unknown_function", "no_function", "decreased_function",
+     "normal_function", "increased_function"],
+    [(0, True), (0, False), (2, True), (2, False)],
+    "undetermined_function",
+)
+
+_metabolizer_default = _Ladder(
+    ["unknown_metabolizer", "poor_metabolizer", "intermediate_metabolizer",
+     "normal_metabolizer", "rapid_metabolizer", "ultrarapid_metabolizer"],
+    [(0, True), (0, False), (1.25, False), (2, False), (2.5, True)],
+    "undetermined_metabolizer",
+)
+
+_metabolizer_cyp2d6 = _Ladder(
+    ["unknown_metabolizer", "poor_metabolizer", "intermediate_metabolizer",
+     "normal_metabolizer", "ultrarapid_metabolizer"],
+    [(0, True), (0, False), (1, False), (2.25, False)],
+    "undetermined_metabolizer",
+)
+
+_metabolizer_dpyd = _Ladder(
+    ["unknown_metabolizer", "poor_metabolizer", "intermediate_metabolizer",
+     "normal_metabolizer", "ultrarapid_metabolizer"],
+    [(0, True), (0.5, False), (2, True), (2, False)],
+    "undetermined_metabolizer",
+)
+
+_transporter_default = _Ladder(
+    ["unknown_function", "poor_function", "decreased_function",
+     "normal_function", "increased_function"],
+    [(0, True), (1, False), (1.5, False), (2, False)],
+    "undetermined_function",
+)
+
+@lru_cache(maxsize=65536)
+def _parse_hap(hap: str) -> Tuple[Tuple[str, int], ...]:
+    result = []
+    for sa in hap.split("+"):
+        if "x" in sa:
+            result.append((sa.split("x")[0], int(sa.split("x")[1])))
+        else:
+            result.append((sa, 1))
+    return tuple(result)
 
 def _hap2as(stardb, hap):
     result = 0
-    for sa in hap.split("+"):
-        if "x" in sa:
-            n = int(sa.split("x")[1])
-            name = sa.split("x")[0]
-            result += stardb[name].score * n
+    for name, n in _parse_hap(hap):
+        if n == 1:
+            result += stardb[name].score
         else:
-            result += stardb[sa].score
+            result += stardb[name].score * n
     return result
 
 ptcallers = {
@@ -163,6 +158,70 @@ ptcallers = {
     "xpc": _phenotype_default,
 }
 
+class _DiplotypeTable:
+    """Lookup tables for phenotyping a single gene.
+
+    Activity scores are precomputed for every star allele and its
+    duplications up to the copy number cap of ``BioHaplotype.add_dup``.
+    Phenotypes are memoized per diplotype, so repeated calls are plain
+    dictionary lookups; other haplotypes (e.g. ``*36+*10``) are resolved
+    by the rule engine on the first miss.
+
+    Args:
+        gene: Target gene.
+        stardb: StarAllele database for the gene.
+    """
+
+    # Upper bound on memoized diplotypes and haplotypes, to guard against
+    # unbounded input.
+    MAX_CALLS = 1000000
+
+    def __init__(self, gene, stardb):
+        self.gene = gene
+        self.stardb = stardb
+        self.caller = ptcallers[gene]
+        self.scores = {}
+        self.calls = {}
+
+        for name, star in stardb.items():
+            self.scores[name] = star.score
+            for cn in range(2, 11):
+                self.scores[f"{name}x{cn}"] = star.score * cn
+
+    def score(self, hap: str) -> float:
+        """Returns the activity score of a haplotype call."""
+        result = self.scores.get(hap)
+        if result is None:
+            result = _hap2as(self.stardb, hap)
+            if len(self.scores) < self.MAX_CALLS:
+                self.scores[hap] = result
+        return result
+
+    def lookup(self, hap1: str, hap2: str) -> str:
+        """Returns the phenotype of a diplotype."""
+        result = self.calls.get((hap1, hap2))
+        if result is None:
+            if isinstance(self.caller, _Ladder):
+                result = self.caller.classify(
+                    self.score(hap1) + self.score(hap2))
+            else:
+                result = self.caller(self.stardb, hap1, hap2)
+            if len(self.calls) < self.MAX_CALLS:
+                self.calls[(hap1, hap2)] = result
+        return result
+
+_tables = {}
+
+def _get_table(gene: str) -> _DiplotypeTable:
+    """Returns the lookup tables for the gene, rebuilding them whenever the
+    underlying StarAllele database has been reloaded."""
+    stardb = get_stardb(gene, "hg19")
+    table = _tables.get(gene)
+    if table is None or table.stardb is not stardb:
+        table = _DiplotypeTable(gene, stardb)
+        _tables[gene] = table
+    return table
+
 def phenotyper(gene: str, hap1: str, hap2: str) -> str:
     """Maps haplotype calls to a phenotype.
 
@@ -302,11 +361,69 @@ def phenotyper(gene: str, hap1: str, hap2: str) -> str:
         * - undetermined_function
           - All other cases
     """
-    stardb = get_stardb(gene, "hg19")
-
     if gene in ptcallers:
-        result = ptcallers[gene](stardb, hap1, hap2)
+        result = _get_table(gene).lookup(hap1, hap2)
     else:
         result = "no_phenotype"
 
     return result
+
+
+def phenotyper_batch(gene: Sequence[str],
+                     hap1: Sequence[str],
+                     hap2: Sequence[str]) -> np.ndarray:
+    """Maps many haplotype calls to phenotypes at once.
+
+    This gives the same results as calling :func:`phenotyper` for each
+    row. Rows are grouped by gene, activity scores are resolved once per
+    distinct haplotype and the phenotypes are assigned with vectorized
+    threshold bins.
+
+    Returns:
+        Phenotypes, one per row.
+
+    Args:
+        gene: Target genes.
+        hap1: 1st haplotype calls.
+        hap2: 2nd haplotype calls.
+
+    Phenotyping a genotype table::
+
+        import pandas as pd
+        from pypgx.phenotyper import phenotyper_batch
+        df = pd.read_table("genotype.txt")
+        df["phenotype"] = phenotyper_batch(
+            df["gene"], df["hap1_main"], df["hap2_main"])
+    """
+    gene = np.asarray(gene, dtype=object)
+    hap1 = np.asarray(hap1, dtype=object)
+    hap2 = np.asarray(hap2, dtype=object)
+
+    if not len(gene) == len(hap1) == len(hap2):
+        raise ValueError("gene, hap1 and hap2 must have the same length")
+
+    result = np.full(len(gene), "no_phenotype", dtype=object)
+    codes, genes = pd.factorize(gene)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(genes) + 1))
+
+    for i, g in enumerate(genes):
+        if g not in ptcallers:
+            continue
+
+        rows = order[bounds[i]:bounds[i + 1]]
+        table = _get_table(g)
+
+        if not isinstance(table.caller, _Ladder):
+            result[rows] = [table.lookup(x, y)
+                            for x, y in zip(hap1[rows], hap2[rows])]
+            continue
+
+        # Look up activity scores once per distinct haplotype.
+        hcodes, haps = pd.factorize(np.concatenate([hap1[rows], hap2[rows]]))
+        scores = np.array([table.score(x) for x in haps], dtype=float)
+        scores = scores[hcodes]
+        totals = scores[:len(rows)] + scores[len(rows):]
+        result[rows] = table.caller.classify_array(totals)
+
+    return result
@@ -1,54 +1,141 @@
-import statistics
-
+import itertools
+from io import StringIO
 from typing import Optional, List, TextIO
 
+import numpy as np
+
+# Number of SDF lines converted at a time.
+CHUNK_SIZE = 10000
+
+def gdf_header(id: List[str]) -> str:
+    """
+    Create the header line of a GDF file.
+
+    Returns:
+        str: GDF header line.
+
+    Args:
+        id (list[str]): Sample ID(s).
+    """
+    result = "Locus\tTotal_Depth\tAverage_Depth_sample"
+    for x in id:
+        result += f"\tDepth_for_{x}"
+    result += "\n"
+    return result
+
+def _format_average(total: np.ndarray, k: int) -> List[str]:
+    # Same as str(round(statistics.mean(x), 2)), computed once for each
+    # distinct total.
+    avg = {}
+    for x in np.unique(total).tolist():
+        avg[x] = str(x // k) if x % k == 0 else str(round(x / k, 2))
+    return [avg[x] for x in total.tolist()]
+
+def format_gdf(contig: str, start: int, depth: np.ndarray) -> str:
+    """
+    Format read depth as GDF lines.
+
+    Values are formatted exactly as sdf2gdf formats SDF input.
+
+    Returns:
+        str: GDF lines.
+
+    Args:
+        contig (str): Contig name.
+        start (int): 1-based position of the first row.
+        depth (numpy.ndarray): Read depth with shape (positions, samples).
+    """
+    n, k = depth.shape
+
+    if not n:
+        return ""
+
+    total = depth.sum(axis=1, dtype=np.int64)
+    loci = [f"{contig}:{x}" for x in range(start, start + n)]
+    columns = [loci, total.astype(str).tolist(), _format_average(total, k)]
+    columns += [x.astype(str).tolist() for x in depth.T]
+
+    return "\n".join(map("\t".join, zip(*columns))) + "\n"
+
+def write_gdf(out: TextIO, f: TextIO, id: List[str]) -> None:
+    """
+    Convert SDF lines to GDF lines, one chunk at a time.
+
+    Depths of each chunk are parsed into an array for the row sums; the
+    depth columns themselves are copied from the input as is.
+
+    Args:
+        out (TextIO): Output GDF file.
+        f (TextIO): Input SDF file.
+        id (list[str]): Sample ID(s).
+    """
+    k = len(id)
+
+    out.write(gdf_header(id))
+
+    while True:
+        lines = list(itertools.islice(f, CHUNK_SIZE))
+
+        if not lines:
+            break
+
+        fields = [x.strip().split("\t", 2) for x in lines]
+
+        # The row sums below need exactly k depths on every line.
+        if any(len(x) < 3 or x[2].count("\t") != k - 1 for x in fields):
+            raise ValueError("incorrect sample count")
+
+        depth = np.fromstring("\t".join([x[2] for x in fields]),
+                              dtype=np.int64, sep="\t")
+
+        if depth.size != len(lines) * k:
+            raise ValueError("incorrect sample count")
+
+        total = depth.reshape(-1, k).sum(axis=1)
+        avg = _format_average(total, k)
+
+        out.write("".join([
+            f"{x[0]}:{x[1]}\t{y}\t{z}\t{x[2]}\n"
+            for x, y, z in zip(fields, total.tolist(), avg)
+        ]))
+
 def sdf2gdf(
         sdf_file: str,
         id: List[str],
-        f: Optional[TextIO] = None, 
+        f: Optional[TextIO] = None,
+        output: Optional[str] = None,
         **kwargs
-    ) -> str:
+    ) -> Optional[str]:
     """
     Create GDF file from SDF file.
 
+    The SDF file is converted in chunks, so memory usage does not depend
+    on its size when the output is written to a file.
+
     Returns:
-        str: GDF file.
+        str: GDF file, unless ``output`` is provided.
 
     Args:
         sdf_file (str): SDF file.
         id (list[str]): Sample ID(s).
         f (TextIO, optional): SDF file.
+        output (str, optional): If provided, write GDF data to this file
+            instead.
     """
 
     if sdf_file:
         f = open(sdf_file)
 
-    # Get the header.
-    result = "Locus\tTotal_Depth\tAverage_Depth_sample"
-    for x in id:
-        result += f"\tDepth_for_{x}"
-    result += "\n"
+    try:
+        if output:
+            with open(output, "w") as out:
+                write_gdf(out, f, id)
+            return None
 
-    # Check the sample count with the first line.
-    fields1 = next(f).strip().split("\t")
-    if len(fields1) - 2 != len(id):
-        raise ValueError("incorrect sample count")
-    locus = f"{fields1[0]}:{fields1[1]}"
-    depth = [int(x) for x in fields1[2:]]
-    avg = round(statistics.mean(depth), 2)
-    fields2 = [locus, sum(depth), avg] + depth
-    result += "\t".join([str(x) for x in fields2]) + "\n"
-
-    # Read rest of the lines.
-    for line in f:
-        fields1 = line.strip().split("\t")
-        locus = f"{fields1[0]}:{fields1[1]}"
-        depth = [int(x) for x in fields1[2:]]
-        avg = round(statistics.mean(depth), 2)
-        fields2 = [locus, sum(depth), avg] + depth
-        result += "\t".join([str(x) for x in fields2]) + "\n"
+        out = StringIO()
+        write_gdf(out, f, id)
+        return out.getvalue()
 
-    if sdf_file:
-        f.close()
-
-    return result
+    finally:
+        if sdf_file:
+            f.close()
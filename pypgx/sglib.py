@@ -7,11 +7,64 @@ import gzip
 import pandas as pd
 import statistics
 from typing import List, Dict, TextIO, Optional
-from copy import deepcopy
+
+class SNPAnnotation:
+    """Static SNP annotation shared between SNPAllele objects.
+
+    Instances are treated as immutable: assigning an annotation attribute
+    through SNPAllele replaces that allele's annotation with a modified
+    copy, leaving other alleles untouched.
+
+    Attributes:
+       rs (str): rs number.
+       n (str): SNP table number.
+       hg (str): Reference allele in the assembly.
+       so (str): Sequence ontology.
+       fe (str): Function effect.
+       vi (str): Variant impact.
+       rv (str): Reverting variant.
+       gb (str): Genome build.
+       data (dict[str, str]): SNP table row.
+    """
+    __slots__ = ("rs", "n", "hg", "so", "fe", "vi", "rv", "gb", "data")
+
+    def __init__(self, rs='', n='', hg='', so='', fe='', vi='', rv='',
+                 gb='', data=None):
+        self.rs = rs
+        self.n = n
+        self.hg = hg
+        self.so = so
+        self.fe = fe
+        self.vi = vi
+        self.rv = rv
+        self.gb = gb
+        self.data = {} if data is None else data
+
+    def replace(self, **kwargs) -> "SNPAnnotation":
+        """Return a copy with the given attributes replaced."""
+        new = SNPAnnotation.__new__(SNPAnnotation)
+        for name in SNPAnnotation.__slots__:
+            setattr(new, name, kwargs.get(name, getattr(self, name)))
+        return new
+
+_EMPTY_ANNOTATION = SNPAnnotation()
+
+def _annotation_property(name):
+    def fget(self):
+        return getattr(self.ann, name)
+
+    def fset(self, value):
+        self.ann = self.ann.replace(**{name: value})
+
+    return property(fget, fset, doc=f"Shared annotation '{name}'.")
 
 class SNPAllele:
     """SNP allele object.
 
+    Per-observation data are stored on the instance while the static
+    annotation (rs, n, hg, so, fe, vi, rv, gb, data) lives in a
+    SNPAnnotation that is shared by reference, e.g. with the SNP database.
+
     Attributes:
        pos (str): Genomic coordinate.
        wt (str): Wild-type allele.
@@ -27,23 +80,28 @@ class SNPAllele:
        vi (str): Variant impact.
        rv (str): Reverting variant.
        gb (str): Genome build.
+       ann (SNPAnnotation): Shared annotation.
     """
-    def __init__(self):
+    __slots__ = ("pos", "wt", "var", "het", "ad", "td", "ann")
+
+    def __init__(self, ann: Optional[SNPAnnotation] = None):
         self.pos = ''
         self.wt = ''
         self.var = ''
-        self.rs = ''
         self.het = False
         self.ad = 0
         self.td = 0
-        self.n = ''
-        self.hg = ''
-        self.so = ''
-        self.fe = ''
-        self.vi = ''
-        self.rv = ''
-        self.gb = ''
-        self.data = {}
+        self.ann = _EMPTY_ANNOTATION if ann is None else ann
+
+    rs = _annotation_property("rs")
+    n = _annotation_property("n")
+    hg = _annotation_property("hg")
+    so = _annotation_property("so")
+    fe = _annotation_property("fe")
+    vi = _annotation_property("vi")
+    rv = _annotation_property("rv")
+    gb = _annotation_property("gb")
+    data = _annotation_property("data")
 
     @property
     def key(self):
@@ -74,6 +132,8 @@ class SNPAllele:
         )
 
 class StarAllele:
+    __slots__ = ("name", "score", "core", "tag", "sv")
+
     def __init__(self):
         self.name = ''
         self.score = -100.0
@@ -113,6 +173,8 @@ class StarAllele:
         return hash(self.name)
 
 class BioHaplotype:
+    __slots__ = ("cand", "obs", "start", "end")
+
     def __init__(self):
         self.cand = []
         self.obs = []
@@ -172,7 +234,7 @@ class BioHaplotype:
         sY = StarAllele()
         sY.name = name
         sY.score = sX.score * cn
-        sY.core = deepcopy(sX.core)
+        sY.core = list(sX.core)
         sY.sv = "cnv{}".format(cn)
 
         self.cand.insert(0, sY)
@@ -197,56 +259,87 @@ class BioSample:
         self.af_df = pd.DataFrame()
 
 def vcf2biosamples(vcf,
-                   filter: bool = False) -> List[BioSample]:
+                   filter: bool = False,
+                   samples: Optional[List[str]] = None) -> List[BioSample]:
     """Convert a VCFFile to a list of BioSample.
 
+    Genotypes and allelic depths of all samples are read from a
+    GenotypeMatrix, and the alleles of each record are then distributed
+    to all samples in a single pass.
+
     Returns:
         A list of BioSample.
 
+    Raises:
+        ValueError: If a genotype is unphased, haploid or has a missing
+        allele.
+
     Args:
         vcf: A VCFFile object.
         filter: If true, exclude any unphased markers.
+        samples: If provided, only convert these samples (in this order).
     """
 
-    result = []
-
-    for name in vcf.header[9:]:
-        biosample = BioSample(name)
-        i = vcf.header.index(name)
-
-        for v in vcf.data:
-            if filter and "D" not in v.info["PS"]:
-                continue
-
-            gt = [int(x) for x in v.fields[i].split(":")[0].split("|")]
-            alleles = [v.ref] + v.alt
-            vi = ["NA"] + v.info["VI"].split(",")
-            so = ["NA"] + v.info["SO"].split(",")
-            fe = ["NA"] + v.info["FE"].split(",")
-            rv = ["NA"] + v.info["RV"].split(",")
+    if samples is None:
+        samples = vcf.header[9:]
+
+    result = [BioSample(x) for x in samples]
+    haps = [(x.hap[0].obs, x.hap[1].obs) for x in result]
+    gb = vcf.search_meta("genome_build")
+
+    matrix = vcf.to_matrix(samples)
+    rows = [r for r, v in enumerate(vcf.data)
+            if not filter or "D" in v.info["PS"]]
+
+    if (matrix.gt[rows] < 0).any():
+        raise ValueError("Genotypes must be diploid without missing alleles")
+
+    if not matrix.phased[rows].all():
+        raise ValueError("Genotypes must be phased")
+
+    for r in rows:
+        v = vcf.data[r]
+        info = v.info
+
+        # Annotations are shared by all samples observing the same allele.
+        vi = ["NA"] + info["VI"].split(",")
+        so = ["NA"] + info["SO"].split(",")
+        fe = ["NA"] + info["FE"].split(",")
+        rv = ["NA"] + info["RV"].split(",")
+        anns = [
+            SNPAnnotation(rs=v.id, so=so[k], vi=vi[k], fe=fe[k], rv=rv[k],
+                          gb=gb)
+            for k in range(len(vi))
+        ]
+
+        pos = str(v.pos)
+        wt = v.ref
+        alleles = [wt] + v.alt
+        has_ad = matrix.has_ad[r]
+        gts = matrix.gt[r].tolist()
+        ads = matrix.ad[r].tolist() if has_ad else None
+
+        for s, obs in enumerate(haps):
+            gt = gts[s]
+            het = gt[0] != gt[1]
+
+            if has_ad:
+                ad = ads[s]
+                td = sum(ad)
 
             for j in [0, 1]:
                 k = gt[j]
-                snpallele = SNPAllele()
-                snpallele.pos = str(v.pos)
-                snpallele.wt = v.ref
+                snpallele = SNPAllele(anns[k])
+                snpallele.pos = pos
+                snpallele.wt = wt
                 snpallele.var = alleles[k]
-                snpallele.rs = v.id
-                snpallele.het = gt[0] != gt[1]
-                snpallele.so = so[k]
-                snpallele.vi = vi[k]
-                snpallele.fe = fe[k]
-                snpallele.rv = rv[k]
-                snpallele.gb = vcf.search_meta("genome_build")
-
-                if "AD" in v.format:
-                    ad = [int(x) for x in v.fields[i].split(":")[1].split(",")]
-                    snpallele.ad = ad[k]
-                    snpallele.td = sum(ad)
+                snpallele.het = het
 
-                biosample.hap[j].obs.append(snpallele)
+                if has_ad:
+                    snpallele.ad = ad[k]
+                    snpallele.td = td
 
-        result.append(biosample)
+                obs[j].append(snpallele)
 
     return result
 
@@ -503,19 +596,20 @@ def build_snpdb(
     result = []
 
     for k, v in snp_table[tg].items():
-        snpallele = SNPAllele()
-        snpallele.n = k
-        snpallele.rs = v['rs_id']
+        snpallele = SNPAllele(SNPAnnotation(
+            rs=v['rs_id'],
+            n=k,
+            hg=v[f'{gb}_allele'],
+            fe=v['functional_effect'],
+            so=v['sequence_ontology'],
+            vi=v['variant_impact'],
+            rv=v[f'{gb}_revertant'],
+            gb=gb,
+            data=v,
+        ))
         snpallele.pos = v[f'{gb}_pos']
-        snpallele.hg = v[f'{gb}_allele']
         snpallele.var = v['var_allele']
         snpallele.wt = v['wt_allele']
-        snpallele.fe = v['functional_effect']
-        snpallele.so = v['sequence_ontology']
-        snpallele.vi = v['variant_impact']
-        snpallele.rv = v[f'{gb}_revertant']
-        snpallele.gb = gb
-        snpallele.data = v
         result.append(snpallele)
 
     return result
@@ -538,6 +632,9 @@ def build_stardb(
         star_table (dict[str, dict[str, dict[str, str]]]): Star table object.
         snpdb (list[SNPAllele]): SNPAllele objects.
 
+    Star alleles share the SNPAllele objects of ``snpdb`` instead of
+    holding copies of them.
+
     Examples:
 
         >>> gene_table = read_gene_table("gene_table.txt")
@@ -549,6 +646,19 @@ def build_stardb(
         1.0
     """
 
+    # Index SNP alleles by their definition, keeping the database order.
+    index = {}
+    for i, x in enumerate(snpdb):
+        index.setdefault((x.pos, x.wt, x.var), []).append((i, x))
+
+    def lookup(s):
+        found = []
+        for definition in s.split(","):
+            pos, change = definition.split(":", 1)
+            wt, var = change.split(">", 1)
+            found += index.get((pos, wt, var), [])
+        return [x for i, x in sorted(set(found), key=lambda y: y[0])]
+
     result = {}
 
     for k, v in star_table[tg].items():
@@ -562,18 +672,12 @@ def build_stardb(
         if v[f"{gb}_core"] in ["ref", "."]:
             starallele.core = []
         else:
-            starallele.core = deepcopy([
-                x for x in snpdb
-                if f"{x.pos}:{x.wt}>{x.var}"  in v[f"{gb}_core"].split(",")
-            ])
+            starallele.core = lookup(v[f"{gb}_core"])
 
         if v[f"{gb}_tag"] == ".":
             starallele.tag = []
         else:
-            starallele.tag = deepcopy([
-                x for x in snpdb
-                if f"{x.pos}:{x.wt}>{x.var}" in v[f"{gb}_tag"].split(",")
-            ])
+            starallele.tag = lookup(v[f"{gb}_tag"])
 
         if v["sv"] == ".":
             starallele.sv = ""
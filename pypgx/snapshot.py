@@ -0,0 +1,262 @@
+import os
+import mmap
+import struct
+import pickle
+import hashlib
+import logging
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+from .sglib import read_gene_table, read_snp_table, read_star_table
+from .version import __version__
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_MAGIC = b"PYPGXTBL"
+SNAPSHOT_TABLES = ["gene_table", "snp_table", "star_table"]
+
+def default_cache_dir() -> str:
+    """Returns the PyPGx cache directory.
+
+    The ``PYPGX_CACHE_DIR`` environment variable takes precedence over
+    ``$XDG_CACHE_HOME/pypgx`` (``~/.cache/pypgx`` by default).
+    """
+    if "PYPGX_CACHE_DIR" in os.environ:
+        return os.environ["PYPGX_CACHE_DIR"]
+    base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(base, "pypgx")
+
+def _stat_sources(dirpath: str) -> Dict[str, Tuple[int, int]]:
+    result = {}
+    for name in SNAPSHOT_TABLES:
+        st = os.stat(f"{dirpath}/{name}.txt")
+        result[name] = (st.st_size, st.st_mtime_ns)
+    return result
+
+def _hash_sources(dirpath: str) -> Dict[str, str]:
+    result = {}
+    for name in SNAPSHOT_TABLES:
+        with open(f"{dirpath}/{name}.txt", "rb") as f:
+            result[name] = hashlib.sha1(f.read()).hexdigest()
+    return result
+
+class TableSnapshot:
+    """Read-only view of a compiled snapshot of the Stargazer tables.
+
+    A snapshot file consists of a magic string, the length of the pickled
+    header, the header itself (format version, source file statistics,
+    gene table and per-gene offsets) and one pickled block per gene holding
+    its SNP and star table rows. The file is memory-mapped and gene blocks
+    are only unpickled on request.
+
+    .. warning::
+        Snapshot files are unpickled, so only load snapshots from a cache
+        directory that is not writable by untrusted users.
+
+    Args:
+        filepath: Snapshot file.
+
+    Attributes:
+        filepath (str): Snapshot file.
+        header (dict): Snapshot header.
+    """
+
+    def __init__(self, filepath: str):
+        """Inits a TableSnapshot."""
+        self.filepath = filepath
+
+        with open(filepath, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        n = len(SNAPSHOT_MAGIC)
+
+        if self._mm[:n] != SNAPSHOT_MAGIC:
+            self.close()
+            raise ValueError(f"Not a PyPGx table snapshot: {filepath}")
+
+        try:
+            size = struct.unpack("<Q", self._mm[n:n + 8])[0]
+            self.header = pickle.loads(self._mm[n + 8:n + 8 + size])
+            self._base = n + 8 + size
+            end = self._base + sum([x[1] for x in
+                                    self.header["index"].values()])
+            if len(self._mm) != end:
+                raise ValueError(f"Truncated table snapshot: {filepath}")
+        except Exception:
+            self.close()
+            raise
+
+        self._rows = {}
+
+    @property
+    def version(self) -> int:
+        """int: Snapshot format version."""
+        return self.header["version"]
+
+    def genes(self) -> List[str]:
+        """Returns the names of genes stored in the snapshot."""
+        return list(self.header["index"])
+
+    def gene_table(self) -> Dict[str, Dict[str, str]]:
+        """Returns the gene table object."""
+        return self.header["gene_table"]
+
+    def rows(self, tg: str) -> Tuple[Optional[Dict], Optional[Dict]]:
+        """Returns the SNP and star table rows for the target gene.
+
+        Either element is None if the gene is absent from that table.
+        """
+        if tg not in self._rows:
+            if tg not in self.header["index"]:
+                return None, None
+            offset, length = self.header["index"][tg]
+            start = self._base + offset
+            self._rows[tg] = pickle.loads(self._mm[start:start + length])
+        return self._rows[tg]
+
+    def is_current(self, dirpath: str) -> bool:
+        """Returns true if the snapshot matches the text tables in dirpath.
+
+        File sizes and modification times are compared first; content
+        hashes are only computed when they differ (e.g. after reinstalling
+        the package).
+        """
+        if self.version != SNAPSHOT_VERSION:
+            return False
+        if self.header["stats"] == _stat_sources(dirpath):
+            return True
+        return self.header["hashes"] == _hash_sources(dirpath)
+
+    def close(self) -> None:
+        """Releases the memory map."""
+        self._mm.close()
+
+def snapshot_path(dirpath: str, cache_dir: Optional[str] = None) -> str:
+    """Returns the snapshot file for the tables in dirpath.
+
+    The file name contains a hash of the real path of dirpath and of the
+    PyPGx version, so different installations and table directories
+    sharing a cache directory do not overwrite each other's snapshot.
+
+    Args:
+        dirpath: Directory containing the Stargazer table files.
+        cache_dir: Directory for snapshot files (default:
+            :func:`default_cache_dir`).
+    """
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+
+    key = f"{os.path.realpath(dirpath)}\0{__version__}"
+    name = hashlib.sha1(key.encode()).hexdigest()[:16]
+
+    return os.path.join(
+        cache_dir, f"sg-tables-v{SNAPSHOT_VERSION}-{name}.pkl")
+
+def build_snapshot(dirpath: str, filepath: str) -> None:
+    """Compiles the text tables in dirpath into a snapshot file.
+
+    The file is written to a temporary path first and then moved into
+    place, so concurrent readers never see a partial snapshot.
+
+    Args:
+        dirpath: Directory containing the Stargazer table files.
+        filepath: Output snapshot file.
+    """
+    stats = _stat_sources(dirpath)
+    hashes = _hash_sources(dirpath)
+    gene_table = read_gene_table(f"{dirpath}/gene_table.txt")
+    snp_table = read_snp_table(f"{dirpath}/snp_table.txt", gene_table)
+    star_table = read_star_table(f"{dirpath}/star_table.txt")
+
+    blocks = []
+    index = {}
+    offset = 0
+
+    for gene in list(snp_table) + [x for x in star_table if x not in snp_table]:
+        block = pickle.dumps((snp_table.get(gene), star_table.get(gene)),
+                             protocol=pickle.HIGHEST_PROTOCOL)
+        index[gene] = (offset, len(block))
+        blocks.append(block)
+        offset += len(block)
+
+    _write_snapshot(filepath, {
+        "version": SNAPSHOT_VERSION,
+        "stats": stats,
+        "hashes": hashes,
+        "gene_table": gene_table,
+        "index": index,
+    }, blocks)
+
+def _write_snapshot(filepath: str, header: Dict, blocks: List[bytes]) -> None:
+    # Written to a temporary path first and then moved into place, so
+    # concurrent readers never see a partial snapshot.
+    header = pickle.dumps(header, protocol=pickle.HIGHEST_PROTOCOL)
+    dirname = os.path.dirname(os.path.abspath(filepath))
+    os.makedirs(dirname, exist_ok=True)
+    fd, temp = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(struct.pack("<Q", len(header)))
+            f.write(header)
+            for block in blocks:
+                f.write(block)
+        os.replace(temp, filepath)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+def _update_stats(snapshot: TableSnapshot,
+                  stats: Dict[str, Tuple[int, int]]) -> TableSnapshot:
+    # The tables have the same content but new sizes or modification times
+    # (e.g. after reinstalling the package). The new statistics are stored
+    # so that later loads do not hash the tables again.
+    try:
+        _write_snapshot(snapshot.filepath, dict(snapshot.header, stats=stats),
+                        [snapshot._mm[snapshot._base:]])
+    except OSError as e:
+        logger.debug(f"Table snapshot statistics not updated: {e}")
+        return snapshot
+
+    snapshot.close()
+
+    return TableSnapshot(snapshot.filepath)
+
+def load_snapshot(dirpath: str,
+                  cache_dir: Optional[str] = None) -> Optional[TableSnapshot]:
+    """Returns an up-to-date snapshot of the tables in dirpath.
+
+    The snapshot is (re)built when missing or stale, and the statistics
+    of the tables stored in it are updated when only those changed. None
+    is returned if
+    the cache directory is not usable, in which case callers should parse
+    the text tables directly.
+
+    Args:
+        dirpath: Directory containing the Stargazer table files.
+        cache_dir: Directory for snapshot files (default:
+            :func:`default_cache_dir`).
+    """
+    filepath = snapshot_path(dirpath, cache_dir)
+
+    try:
+        snapshot = TableSnapshot(filepath)
+        if snapshot.is_current(dirpath):
+            stats = _stat_sources(dirpath)
+            if snapshot.header["stats"] != stats:
+                snapshot = _update_stats(snapshot, stats)
+            return snapshot
+        snapshot.close()
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.debug(f"Ignoring unreadable table snapshot: {e}")
+
+    try:
+        build_snapshot(dirpath, filepath)
+        return TableSnapshot(filepath)
+    except OSError as e:
+        logger.debug(f"Table snapshot disabled: {e}")
+        return None
@@ -1,37 +1,131 @@
-import pysam
+import numpy as np
 import pandas as pd
-from typing import Optional, List
-from io import StringIO
-from .common import bam_getter, sm_tag
+from typing import Optional, List, Tuple
+from .common import bam_getter, bam_headers
+from .sglib import parse_region
+from .depth import bam_depths, bed_regions, WINDOW_ALIGN
 
 COVERAGES = [1, 10, 20, 30, 40, 50, 100, 200, 300, 400, 500, 1000]
 
+# Maximum number of depth values (positions x samples) held in memory.
+BATCH_SIZE = 10000000
+
+def _batches(regions: List[str], size: int):
+    # Split regions into pieces of at most size positions and group the
+    # pieces into batches of at most size positions. Each piece is yielded
+    # with the index of its region.
+    batch = []
+    n = 0
+
+    for i, region in enumerate(regions):
+        contig, start, end = parse_region(region)
+        for x in range(start, end + 1, size):
+            y = min(x + size - 1, end)
+            if batch and n + y - x + 1 > size:
+                yield batch
+                batch = []
+                n = 0
+            batch.append((i, f"{contig}:{x}-{y}"))
+            n += y - x + 1
+
+    if batch:
+        yield batch
+
+def coverage_counts(
+        bam_files: List[str],
+        regions: List[str],
+        coverages: List[int],
+        jobs: int = 1,
+        cache_dir: Optional[str] = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Count base pairs sequenced at or above each coverage, per region.
+
+    Read depth is computed in batches of bounded size, and each depth is
+    binned by the number of coverages it reaches (``searchsorted``) so
+    that a single ``bincount`` per batch and sample gives the counts of
+    all regions and coverages at once.
+
+    Returns:
+        tuple: Counts with shape (regions, samples, coverages), total read
+        depth with shape (regions, samples) and the number of base pairs
+        of each region.
+
+    Args:
+        bam_files (list[str]): BAM files.
+        regions (list[str]): Regions, which must not overlap.
+        coverages (list[int]): Coverages, in increasing order.
+        jobs (int): Number of processes for computing read depth.
+        cache_dir (str, optional): Directory for caching read depth.
+    """
+    k = len(bam_files)
+    m = len(coverages) + 1
+    thresholds = np.array(coverages)
+    bins = np.zeros((len(regions), k, m), dtype=np.int64)
+    totals = np.zeros((len(regions), k), dtype=np.int64)
+    sizes = np.zeros(len(regions), dtype=np.int64)
+    n = len(regions) * m
+    size = max(BATCH_SIZE // max(k, 1) // WINDOW_ALIGN, 1) * WINDOW_ALIGN
+
+    for batch in _batches(regions, size):
+        depths = bam_depths(bam_files, [x[1] for x in batch], jobs=jobs,
+                            cache_dir=cache_dir)
+        lengths = [x[2].shape[0] for x in depths]
+        index = np.repeat([x[0] for x in batch], lengths)
+        depth = np.concatenate([x[2] for x in depths])
+        np.add.at(sizes, [x[0] for x in batch], lengths)
+
+        for j in range(k):
+            b = np.searchsorted(thresholds, depth[:, j], side="right")
+            bins[:, j, :] += np.bincount(index * m + b,
+                                         minlength=n).reshape(-1, m)
+            totals[:, j] += np.bincount(index, weights=depth[:, j],
+                                        minlength=len(regions)).astype(
+                                            np.int64)
+
+    # Base pairs in bin b reach the first b coverages.
+    counts = bins[:, :, ::-1].cumsum(axis=2)[:, :, ::-1][:, :, 1:]
+
+    return counts, totals, sizes
+
 @bam_getter
 def unicov(bed_file,
            bam_file: List[str],
            bam_dir: Optional[str] = None,
            bam_list: Optional[str] = None,
+           jobs: int = 1,
+           cache_dir: Optional[str] = None,
+           coverage: Optional[List[int]] = None,
+           by_interval: bool = False,
            **kwargs):
 
     input_files = kwargs["input_files"]
-    names = [sm_tag(x) for x in input_files]
-    s = pysam.depth("-a", "-b", bed_file, *input_files)
-    f = StringIO(s)
-    df = pd.read_table(f)
-    df.columns = ["chr", "pos"] + names
-    size = df.shape[0]
+    names = [x.sample for x in bam_headers(input_files)]
+    regions = bed_regions(bed_file, input_files[0])
+    coverages = sorted(set(coverage)) if coverage else COVERAGES
+    counts, totals, sizes = coverage_counts(
+        input_files, regions, coverages, jobs, cache_dir)
 
-    dat = {"coverage": COVERAGES}
+    if by_interval:
+        rows = []
+        for i, region in enumerate(regions + ["all"]):
+            if region == "all":
+                count, total, size = counts.sum(0), totals.sum(0), sizes.sum()
+            else:
+                count, total, size = counts[i], totals[i], sizes[i]
+            for j, name in enumerate(names):
+                rows.append([region, name, total[j] / size]
+                            + (count[j] / size * 100).tolist())
+        df = pd.DataFrame(rows, columns=["region", "sample", "mean"]
+                          + coverages)
+        return df.to_csv(sep="\t", index=False)
 
-    for name in names:
-        percs = []
+    size = int(sizes.sum())
 
-        for coverage in COVERAGES:
-            count = sum(df[name] >= coverage)
-            perc = count / size * 100
-            percs.append(perc)
+    dat = {"coverage": coverages}
 
-        dat[name] = percs
+    for i, name in enumerate(names):
+        dat[name] = (counts[:, i, :].sum(axis=0) / size * 100).tolist()
 
     df = pd.DataFrame(dat)
 
@@ -26,7 +26,8 @@ def viewsnp(
     target_gene = finalized_vcf.search_meta("target_gene")
     genome_build = finalized_vcf.search_meta("genome_build")
 
-    biosamples = vcf2biosamples(finalized_vcf, False)
+    samples = list(dict.fromkeys([x.split("/")[0] for x in query]))
+    biosamples = vcf2biosamples(finalized_vcf, False, samples)
     stardb = get_stardb(target_gene, genome_build)
     temp = []
 
@@ -2,8 +2,8 @@ from setuptools import setup, find_packages
 
 exec(open("pypgx/version.py").read())
 
-requirements = ["requests>=2", "pandas>=1.0.0", "bs4>=0.0.1", "lxml>=4.5.0",
-                "pysam>=0.16.0",]
+requirements = ["requests>=2", "numpy>=1.16.0", "pandas>=1.0.0", "bs4>=0.0.1",
+                "lxml>=4.5.0", "pysam>=0.16.0",]
 
 setup(
     name="pypgx",
@@ -0,0 +1,87 @@
+import os
+from io import StringIO
+
+import numpy as np
+import pysam
+
+from pypgx.bam2sdf import bam2sdf, bam2depth, bam2depths
+from pypgx.bam2gdf import bam2gdf
+from pypgx.sdf2gdf import sdf2gdf
+
+CONTROL = "chr22:42600001-42601000"
+
+def write_bam(path, sample, seed):
+    # Random reads over CYP2D6, CYP2C19 and the control region (hg19).
+    header = {"HD": {"VN": "1.6", "SO": "coordinate"},
+              "SQ": [{"SN": "chr10", "LN": 135534747},
+                     {"SN": "chr22", "LN": 51304566}],
+              "RG": [{"ID": "1", "SM": sample}]}
+    rng = np.random.default_rng(seed)
+    reads = []
+    for tid, start, end in [(0, 96519400, 96616000),
+                            (1, 42512400, 42552000),
+                            (1, 42600000, 42601000)]:
+        for x in np.sort(rng.integers(start, end, size=200)).tolist():
+            reads.append((tid, x))
+    with pysam.AlignmentFile(path, "wb", header=header) as f:
+        for i, (tid, start) in enumerate(reads):
+            a = pysam.AlignedSegment()
+            a.query_name = f"r{i}"
+            a.cigarstring = "50M"
+            a.query_sequence = "A" * 50
+            a.reference_id = tid
+            a.reference_start = start
+            a.mapping_quality = 60
+            a.set_tag("RG", "1")
+            f.write(a)
+    pysam.index(path)
+    return path
+
+def write_bams(tmp_path):
+    return [write_bam(str(tmp_path / f"{x}.bam"), x, i)
+            for i, x in enumerate(["A", "B", "C"])]
+
+def test_bam2sdf_jobs(tmp_path):
+    bams = write_bams(tmp_path)
+    expected = bam2sdf("hg19", "cyp2d6", CONTROL, bams)
+    assert expected == "".join(
+        pysam.depth("-a", "-r", x, *bams)
+        for x in ["chr22:42512500-42551883", CONTROL])
+    assert bam2sdf("hg19", "cyp2d6", CONTROL, bams, jobs=2) == expected
+
+def test_bam2sdf_genes(tmp_path):
+    bams = write_bams(tmp_path)
+    genes = ["cyp2d6", "cyp2c19"]
+    depths = bam2depths("hg19", genes, CONTROL, bams)
+    assert list(depths) == genes
+    for gene in genes:
+        expected = bam2depth("hg19", gene, CONTROL, bams)
+        assert len(depths[gene]) == len(expected)
+        for (c1, s1, d1), (c2, s2, d2) in zip(depths[gene], expected):
+            assert (c1, s1) == (c2, s2) and (d1 == d2).all()
+
+    # A trailing comma still means a single gene.
+    single = bam2sdf("hg19", "cyp2d6", CONTROL, bams)
+    assert bam2sdf("hg19", "cyp2d6,", CONTROL, bams) == single
+
+    sdf_dir = str(tmp_path / "sdf")
+    gdf_dir = str(tmp_path / "gdf")
+    assert bam2sdf("hg19", ",".join(genes), CONTROL, bams,
+                   output=sdf_dir) is None
+    bam2gdf(genome_build="hg19", target_gene=",".join(genes),
+            control_gene=CONTROL, output_file=gdf_dir, bam_file=bams)
+    assert sorted(os.listdir(sdf_dir)) == ["cyp2c19.sdf", "cyp2d6.sdf"]
+    assert sorted(os.listdir(gdf_dir)) == ["cyp2c19.gdf", "cyp2d6.gdf"]
+
+    for gene in genes:
+        sdf = bam2sdf("hg19", gene, CONTROL, bams)
+        with open(f"{sdf_dir}/{gene}.sdf") as f:
+            assert f.read() == sdf
+        gdf_file = str(tmp_path / f"{gene}.gdf")
+        bam2gdf(genome_build="hg19", target_gene=gene, control_gene=CONTROL,
+                output_file=gdf_file, bam_file=bams)
+        with open(f"{gdf_dir}/{gene}.gdf") as f, open(gdf_file) as g:
+            assert f.read() == g.read()
+        with open(gdf_file) as f:
+            assert f.read() == sdf2gdf(None, ["A", "B", "C"],
+                                       f=StringIO(sdf))
@@ -0,0 +1,68 @@
+import subprocess
+
+import pysam
+
+from pypgx import bam2vcf as module
+from pypgx.bam2vcf import bam2vcf
+
+def write_bams(tmp_path, n):
+    header = {"SQ": [{"SN": "chr22", "LN": 1000}]}
+    result = []
+    for i in range(n):
+        path = str(tmp_path / f"{i}.bam")
+        with pysam.AlignmentFile(path, "wb", header=header):
+            pass
+        result.append(path)
+    return result
+
+def run_bam2vcf(tmp_path, monkeypatch, n, shard_size):
+    commands = []
+    monkeypatch.setattr(subprocess, "run",
+                        lambda x, check: commands.append(x))
+    temp_dir = tmp_path / "temp"
+    temp_dir.mkdir()
+    bams = write_bams(tmp_path, n)
+    bam2vcf(snp_caller="bcftools", fasta_file="ref.fa",
+            target_gene="chr22:100-200", output_file="out.vcf",
+            genome_build="hg19", bam_file=bams, temp_dir=str(temp_dir),
+            shard_size=shard_size)
+    # File names are made relative to the temporary directory.
+    t = str(temp_dir) + "/"
+    commands = [[y.replace(t, "") for y in x] for x in commands]
+    return bams, commands
+
+def test_bam2vcf_shards(tmp_path, monkeypatch):
+    monkeypatch.setattr(module, "MERGE_SIZE", 2)
+    bams, commands = run_bam2vcf(tmp_path, monkeypatch, 7, 2)
+    mpileup = [x for x in commands if x[1] == "mpileup"]
+    assert [x[15:] for x in mpileup] == [
+        bams[0:2], bams[2:4], bams[4:6], bams[6:7]]
+    merges = [x for x in commands if x[1] == "merge"]
+    assert merges == [
+        ["bcftools", "merge", "-Oz", "-m", "both", "-o", "merge0_0.vcf.gz",
+         "shard0.vcf.gz", "shard1.vcf.gz"],
+        ["bcftools", "merge", "-Oz", "-m", "both", "-o", "merge0_1.vcf.gz",
+         "shard2.vcf.gz", "shard3.vcf.gz"],
+        ["bcftools", "merge", "-Ou", "-m", "both", "-o", "merged.bcf",
+         "merge0_0.vcf.gz", "merge0_1.vcf.gz"],
+    ]
+    assert [x[1] for x in commands] == (
+        ["mpileup", "call", "index"] * 4
+        + ["merge", "index", "merge", "index", "merge"]
+        + ["view", "index", "norm", "filter"])
+
+def test_bam2vcf_merge_size(tmp_path, monkeypatch):
+    monkeypatch.setattr(module, "MERGE_SIZE", 2)
+    bams, commands = run_bam2vcf(tmp_path, monkeypatch, 5, 2)
+    merges = [x[6:] for x in commands if x[1] == "merge"]
+    # A group of one file is passed on to the next round as is.
+    assert merges == [
+        ["merge0_0.vcf.gz", "shard0.vcf.gz", "shard1.vcf.gz"],
+        ["merged.bcf", "merge0_0.vcf.gz", "shard2.vcf.gz"],
+    ]
+
+def test_bam2vcf_single_shard(tmp_path, monkeypatch):
+    bams, commands = run_bam2vcf(tmp_path, monkeypatch, 3, 0)
+    assert commands[0][15:] == bams
+    assert [x[1] for x in commands] == [
+        "mpileup", "call", "index", "norm", "filter"]
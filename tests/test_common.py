@@ -0,0 +1,197 @@
+import gc
+import json
+import os
+import warnings
+
+import pysam
+import pytest
+
+from pypgx.common import (
+    get_stardb, clear_tables, VCFFile, Record, _parse_schema, FilterPipeline,
+    MultiallelicFilter, MissingFilter, GenotypeMatrix, read_genotypes,
+    genotype_concordance, BAMHeaderCache
+)
+
+def test_get_stardb():
+    stardb = get_stardb("cyp2d6", "hg19")
+    assert stardb["*2"].score == 1.0
+    assert get_stardb("cyp2d6", "hg19") is stardb
+    clear_tables("cyp2d6")
+    assert get_stardb("cyp2d6", "hg19") is not stardb
+
+VCF = (
+    "##fileformat=VCFv4.2\n"
+    "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tA\tB\n"
+    "chr22\t100\t.\tA\tG\t50\tPASS\tDP=10\tGT:AD\t0/1:5,5\t0/0:10,0\n"
+    "chr22\t200\t.\tC\tT,G\t50\tPASS\tDP=10\tGT:AD\t./.:0,0,0\t1/2:0,4,6\n"
+    "chr22\t300\t.\tG\tA\t50\tPASS\tDP=10\tGT:AD\t1/1:0,9\t0/1:4,5\n"
+)
+
+def write_vcf(tmp_path):
+    path = tmp_path / "test.vcf"
+    path.write_text(VCF)
+    return str(path)
+
+def test_iter_records(tmp_path):
+    vcf = VCFFile(write_vcf(tmp_path))
+    records = vcf.iter_records("22:150-300")
+    assert vcf.header[9:] == ["A", "B"]
+    assert [x.pos for x in records] == [200, 300]
+    assert not vcf.data
+    vcf.read()
+    assert vcf.to_str() == VCF
+
+def write_indexed_vcf(tmp_path):
+    lines = VCF.splitlines(True)
+    lines.insert(2, "chr21\t100\t.\tA\tG\t50\tPASS\tDP=10\tGT:AD\t"
+                    "0/1:5,5\t0/0:10,0\n")
+    path = tmp_path / "test.vcf"
+    path.write_text("".join(lines))
+    pysam.tabix_compress(str(path), f"{path}.gz")
+    pysam.tabix_index(f"{path}.gz", preset="vcf")
+    return str(path)
+
+def test_iter_records_indexed(tmp_path):
+    path = write_indexed_vcf(tmp_path)
+    indexed = VCFFile(f"{path}.gz")
+    assert indexed.index_file == f"{path}.gz.tbi"
+    cases = [
+        ["22:150-300"],
+        ["22:100-100", "chr22:300-300", "21:1-1000"],
+        ["22:50-150", "22:120-250", "22:240-260"],
+        ["chr22"],
+        ["21", "22:200-200"],
+        ["22:301-400", "19"],
+    ]
+    for region in cases:
+        records = indexed.iter_records(region)
+        assert indexed.header[9:] == ["A", "B"]
+        expected = [(x.chrom, x.pos) for x in
+                    VCFFile(path).iter_records(region)]
+        assert [(x.chrom, x.pos) for x in records] == expected
+    assert [x.pos for x in indexed.iter_records("22:50-150")] == [100]
+    assert [x.chrom for x in indexed.iter_records("22", tidy=True)] == [
+        "22", "22", "22"]
+
+def test_iter_records_not_indexed(tmp_path):
+    path = write_indexed_vcf(tmp_path)
+    os.remove(f"{path}.gz.tbi")
+    vcf = VCFFile(f"{path}.gz")
+    assert not vcf.index_file
+    records = vcf.iter_records(["22:200-300", "21"])
+    assert [(x.chrom, x.pos) for x in records] == [
+        ("chr21", 100), ("chr22", 200), ("chr22", 300)]
+
+def test_iter_records_unconsumed(tmp_path):
+    vcf = VCFFile(write_vcf(tmp_path))
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", ResourceWarning)
+        vcf.iter_records()
+        records = vcf.iter_records()
+        next(records)
+        records.close()
+        gc.collect()
+
+def test_record():
+    meta = ['##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">\n']
+    fields = "22\t100\t.\tA\tG,T\t.\t.\tDP=10;DB\tGT:AD\t0/1:5,5,0".split("\t")
+    record = Record(fields, _parse_schema(meta))
+    assert record.info == {"DP": "10", "DB": True}
+    assert record.typed_info == {"DP": 10, "DB": True}
+    assert record.typed_sample(0) == {"GT": "0/1", "AD": "5,5,0"}
+    record.filter += ["MultiallelicFilter"]
+    record.pos = 101
+    assert record.fields[1] == "101"
+    assert record.fields[6] == "MultiallelicFilter"
+
+def test_filter_pipeline(tmp_path):
+    vcf = VCFFile(write_vcf(tmp_path))
+    pipeline = FilterPipeline([MultiallelicFilter(), MissingFilter()])
+    kept, filtered = pipeline.run(vcf.iter_records())
+    assert [x.pos for x in kept] == [100, 300]
+    assert [x.filter for x in filtered] == [["MultiallelicFilter"]]
+    assert pipeline.counts == {"MultiallelicFilter": 1, "MissingFilter": 0}
+
+def test_genotype_matrix(tmp_path):
+    vcf = VCFFile(write_vcf(tmp_path))
+    vcf.read()
+    matrix = vcf.to_matrix()
+    assert matrix.gt.shape == (3, 2, 2)
+    assert matrix.missing.tolist() == [[False, False], [True, False], [False, False]]
+    assert matrix.alt_counts().tolist() == [[1, 0], [0, 2], [2, 1]]
+    assert matrix.ad[1].tolist() == [[0, 0, 0], [0, 4, 6]]
+    assert matrix.ad[0, 0].tolist() == [5, 5, 0]
+    assert vcf.to_matrix(["B"]).gt[:, 0].tolist() == [[0, 0], [1, 2], [0, 1]]
+    fields = VCF.splitlines()[2].split("\t")
+    fields[4] = ",".join(["T"] * 200)
+    fields[9] = "0|200"
+    matrix = GenotypeMatrix.from_records([Record(fields, vcf.schema)])
+    assert matrix.gt[0].tolist() == [[0, 200], [0, 0]]
+    assert matrix.phased[0].tolist() == [True, False]
+
+def test_genotype_concordance(tmp_path):
+    header = "gene\tname\tstatus\thap1_main\thap2_main\n"
+    truth = tmp_path / "truth.txt"
+    truth.write_text(header + "cyp2d6\tA\tg\t*1\t*4\n"
+                     + "cyp2d6\tB\tg\t*1\t*1\n"
+                     + "cyp2c19\tA\tg\t*2\t*17\n")
+    test = tmp_path / "test.txt"
+    test.write_text(header + "cyp2d6\tB\tg\t*1\t*2\n"
+                    + "cyp2d6\tA\tg\t*4\t*1\n")
+    df = genotype_concordance(read_genotypes(str(truth)),
+                              [read_genotypes(str(test))])
+    assert df["hap1_match"].tolist() == [True, True, False]
+    assert df["hap2_match"].tolist() == [True, False, False]
+    assert genotype_concordance(read_genotypes(str(truth)), []).empty
+    test.write_text(header + "cyp2d6\tA\tg\t*1\t*4\n"
+                    + "cyp2d6\tA\tg\t*1\t*4\n")
+    with pytest.raises(ValueError, match="cyp2d6"):
+        read_genotypes(str(test))
+
+def test_bam_header_cache(tmp_path):
+    bam = str(tmp_path / "test.bam")
+    header = {"SQ": [{"SN": "chr22", "LN": 1000}],
+              "RG": [{"ID": "a", "SM": "S1"}, {"ID": "b", "SM": "S1"}]}
+    with pysam.AlignmentFile(bam, "wb", header=header):
+        pass
+    sidecar = str(tmp_path / "headers.json")
+    result = BAMHeaderCache(sidecar).scan([bam, bam])
+    assert [x.samples for x in result] == [["S1"], ["S1"]]
+    assert result[0].contigs == {"chr22": 1000} and result[0].is_chr
+    assert not result[0].has_index
+    cached = BAMHeaderCache(sidecar)
+    assert cached.scan([bam])[0].contigs == {"chr22": 1000}
+    assert result[0].sample == "S1"
+
+    # A modified file replaces its entry and a deleted one is dropped.
+    other = str(tmp_path / "other.bam")
+    header["RG"] = [{"ID": "a", "SM": "S2"}, {"ID": "b", "SM": "S3"}]
+    for path in [bam, other]:
+        with pysam.AlignmentFile(path, "wb", header=header):
+            pass
+    os.utime(bam, ns=(0, 0))
+    assert [x.sample for x in cached.scan([bam, other])] == ["S2", "S2"]
+    with open(sidecar) as f:
+        assert len(json.load(f)) == 2
+    os.remove(other)
+    os.utime(bam, ns=(1, 1))
+    cached.scan([bam])
+    with open(sidecar) as f:
+        entries = json.load(f)
+    assert list(entries) == [os.path.realpath(bam)]
+
+    # Malformed entries are ignored.
+    entries["x"] = {"samples": "S1", "contigs": []}
+    entries["y"] = None
+    with open(sidecar, "w") as f:
+        json.dump(entries, f)
+    cached = BAMHeaderCache(sidecar)
+    assert list(cached._entries) == [os.path.realpath(bam)]
+    with open(sidecar, "w") as f:
+        json.dump([1, 2], f)
+    assert BAMHeaderCache(sidecar).scan([bam])[0].samples == ["S2", "S3"]
+
+    with pysam.AlignmentFile(bam, "wb", header={"SQ": header["SQ"]}):
+        pass
+    with pytest.raises(ValueError, match="SM tag not found"):
+        cached.scan([bam])[0].sample
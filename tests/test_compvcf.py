@@ -0,0 +1,35 @@
+import numpy as np
+
+from pypgx.compvcf import compvcf
+
+def write_vcf(path, samples, genotypes):
+    lines = ["##fileformat=VCFv4.2\n",
+             "\t".join(["#CHROM", "POS", "ID", "REF", "ALT", "QUAL",
+                        "FILTER", "INFO", "FORMAT"] + samples) + "\n"]
+    alleles = [("A", "G"), ("C", "T"), ("G", "GA"), ("TC", "T")]
+    for i, row in enumerate(genotypes):
+        ref, alt = alleles[i % len(alleles)]
+        lines.append("\t".join(["chr22", str(100 + i * 10), ".", ref, alt,
+                                "50", "PASS", ".", "GT"] + row) + "\n")
+    path.write_text("".join(lines))
+    return str(path)
+
+def test_compvcf_jobs(tmp_path):
+    rng = np.random.default_rng(0)
+    choices = np.array(["0/0", "0/1", "1/1", "./."])
+    p = [0.4, 0.3, 0.25, 0.05]
+    truth = write_vcf(tmp_path / "truth.vcf", ["A", "B", "C", "D"],
+                      rng.choice(choices, size=(40, 4), p=p).tolist())
+    test = write_vcf(tmp_path / "test.vcf", ["d", "c", "b", "a"],
+                     rng.choice(choices, size=(40, 4), p=p).tolist())
+    sample_map = tmp_path / "map.txt"
+    sample_map.write_text("A\ta\nB\tb\nC\tc\nD\td\n")
+    bed = tmp_path / "strata.bed"
+    bed.write_text("chr22\t99\t250\tx\nchr22\t200\t600\ty\n")
+    for strata in [None, str(bed)]:
+        expected = compvcf(truth, test, str(sample_map), strata=strata)
+        assert len(expected.splitlines()) == 1 + 4 * (1 if strata is None
+                                                      else 2)
+        for jobs in [2, 3]:
+            assert compvcf(truth, test, str(sample_map), strata=strata,
+                           jobs=jobs) == expected
@@ -0,0 +1,76 @@
+import os
+
+import pysam
+
+from pypgx import depth
+from pypgx.depth import bam_depth, bam_depths, format_sdf
+from pypgx.unicov import coverage_counts
+
+def write_bam(path):
+    header = {"HD": {"VN": "1.6", "SO": "coordinate"},
+              "SQ": [{"SN": "chr22", "LN": 1000}]}
+    reads = [
+        # (start, cigar, flag, mapq)
+        (10, "50M", 0, 60),
+        (20, "10M5D10M100N10M", 16, 60),
+        (25, "5S20M3I20M", 0, 60),
+        (30, "50M", 0x400, 60),
+        (40, "50M", 0, 0),
+        (930, "60M", 0, 60),
+    ]
+    with pysam.AlignmentFile(path, "wb", header=header) as f:
+        for i, (start, cigar, flag, mapq) in enumerate(reads):
+            a = pysam.AlignedSegment()
+            a.query_name = f"r{i}"
+            a.cigarstring = cigar
+            a.query_sequence = "A" * a.infer_query_length()
+            a.reference_id = 0
+            a.reference_start = start
+            a.flag = flag
+            a.mapping_quality = mapq
+            f.write(a)
+    pysam.index(path)
+    return path
+
+def test_bam_depth(tmp_path):
+    bam = write_bam(str(tmp_path / "test.bam"))
+    for region in ["chr22:1-1000", "chr22:30-60", "chr22:980-1100"]:
+        for mapq in [0, 1]:
+            expected = pysam.depth("-a", "-Q", str(mapq), "-r", region, bam)
+            assert format_sdf(*bam_depth([bam], region, mapq)) == expected
+
+def test_bam_depths_jobs(tmp_path, monkeypatch):
+    # Small windows split the 1,000 bp contig of a single BAM file.
+    monkeypatch.setattr(depth, "WINDOW_ALIGN", 64)
+    bam = write_bam(str(tmp_path / "test.bam"))
+    regions = ["chr22:1-1000", "chr22:30-60", "chr22:100-900"]
+    expected = bam_depths([bam], regions, 1)
+    for jobs in [2, 3]:
+        result = bam_depths([bam], regions, 1, jobs=jobs)
+        for (c1, s1, d1), (c2, s2, d2) in zip(result, expected):
+            assert (c1, s1) == (c2, s2) and (d1 == d2).all()
+    assert len(depth._windows(1, 1000, 2)) == 8
+
+def test_bam_depths_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(depth.DepthCache, "CHUNK_SIZE", 256)
+    monkeypatch.setattr(depth.DepthCache, "MIN_REGION", 64)
+    bam = write_bam(str(tmp_path / "test.bam"))
+    regions = ["chr22:30-60", "chr22:1-1000", "chr22:500-700"]
+    expected = bam_depths([bam], regions, 1)
+    cache_dir = str(tmp_path / "cache")
+    for jobs in [1, 1, 2]:
+        result = bam_depths([bam], regions, 1, jobs=jobs, cache_dir=cache_dir)
+        for (c1, s1, d1), (c2, s2, d2) in zip(result, expected):
+            assert (c1, s1) == (c2, s2) and (d1 == d2).all()
+    # Only the chunks of the two longer regions are cached.
+    files = [x for _, _, f in os.walk(cache_dir) for x in f]
+    assert len(files) == 4
+
+def test_coverage_counts(tmp_path):
+    bam = write_bam(str(tmp_path / "test.bam"))
+    regions = ["chr22:1-100", "chr22:900-1000"]
+    counts, totals, sizes = coverage_counts([bam], regions, [1, 2, 3])
+    for i, region in enumerate(regions):
+        depth = bam_depth([bam], region)[2][:, 0]
+        assert sizes[i] == len(depth) and totals[i, 0] == depth.sum()
+        assert counts[i, 0].tolist() == [(depth >= x).sum() for x in [1, 2, 3]]
@@ -1,7 +1,42 @@
-from pypgx.phenotyper import phenotyper
+from pypgx.common import get_stardb, clear_tables
+from pypgx.phenotyper import (
+    phenotyper, phenotyper_batch, _get_table, _hap2as, _DiplotypeTable
+)
 
 def test_phenotyper():
     assert phenotyper("cyp2d6", "*1", "*1") == "normal_metabolizer"
     assert phenotyper("cyp2d6", "*1", "*4") == "intermediate_metabolizer"
     assert phenotyper("cyp2d6", "*1", "*2x2") == "ultrarapid_metabolizer"
-    assert phenotyper("cyp2d6", "*4", "*5") == "poor_metabolizer"
\ No newline at end of file
+    assert phenotyper("cyp2d6", "*4", "*5") == "poor_metabolizer"
+
+def test_phenotyper_batch():
+    gene = ["cyp2d6", "cyp2d6", "cyp2d6", "cyp2d6", "foo"]
+    hap1 = ["*1", "*1", "*1", "*4", "*1"]
+    hap2 = ["*1", "*4", "*2x2", "*5", "*1"]
+    assert list(phenotyper_batch(gene, hap1, hap2)) == [
+        phenotyper(x, y, z) for x, y, z in zip(gene[:4], hap1, hap2)
+    ] + ["no_phenotype"]
+
+def test_diplotype_table():
+    table = _get_table("cyp2d6")
+    stardb = get_stardb("cyp2d6", "hg19")
+    for hap in ["*2x3", "*1x12", "*36+*10", "*4x2"]:
+        assert table.score(hap) == _hap2as(stardb, hap)
+    assert table.score("*2x3") == stardb["*2"].score * 3
+    score = _hap2as(stardb, "*36+*10") + _hap2as(stardb, "*4")
+    expected = table.caller.classify(score)
+    assert phenotyper("cyp2d6", "*36+*10", "*4") == expected
+    assert table.calls[("*36+*10", "*4")] == expected
+    clear_tables("cyp2d6")
+    rebuilt = _get_table("cyp2d6")
+    assert rebuilt is not table
+    assert rebuilt.stardb is get_stardb("cyp2d6", "hg19")
+
+def test_diplotype_table_cap(monkeypatch):
+    table = _DiplotypeTable("cyp2d6", get_stardb("cyp2d6", "hg19"))
+    monkeypatch.setattr(_DiplotypeTable, "MAX_CALLS", len(table.scores) + 2)
+    for cn in range(11, 20):
+        table.score(f"*1x{cn}")
+        table.lookup(f"*1x{cn}", "*1")
+    assert len(table.scores) == _DiplotypeTable.MAX_CALLS
+    assert len(table.calls) == 9
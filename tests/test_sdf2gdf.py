@@ -0,0 +1,45 @@
+import statistics
+from io import StringIO
+
+import numpy as np
+import pytest
+
+from pypgx import sdf2gdf as module
+from pypgx.sdf2gdf import sdf2gdf, format_gdf
+
+def reference(sdf, id):
+    # Line-by-line conversion of the original implementation.
+    result = "Locus\tTotal_Depth\tAverage_Depth_sample"
+    for x in id:
+        result += f"\tDepth_for_{x}"
+    result += "\n"
+    for line in sdf.splitlines():
+        fields = line.strip().split("\t")
+        depth = [int(x) for x in fields[2:]]
+        avg = round(statistics.mean(depth), 2)
+        result += "\t".join([str(x) for x in [
+            f"{fields[0]}:{fields[1]}", sum(depth), avg] + depth]) + "\n"
+    return result
+
+def test_sdf2gdf(monkeypatch):
+    monkeypatch.setattr(module, "CHUNK_SIZE", 3)
+    rng = np.random.default_rng(0)
+    for k in [1, 2, 3, 7]:
+        depth = rng.integers(0, 1000, size=(10, k))
+        depth[0] = 0
+        sdf = "".join(f"chr22\t{i + 100}\t" + "\t".join(map(str, x)) + "\n"
+                      for i, x in enumerate(depth.tolist()))
+        id = [f"S{i}" for i in range(k)]
+        expected = reference(sdf, id)
+        assert sdf2gdf(None, id, f=StringIO(sdf)) == expected
+        assert module.gdf_header(id) + format_gdf(
+            "chr22", 100, depth) == expected
+
+def test_sdf2gdf_malformed(monkeypatch):
+    monkeypatch.setattr(module, "CHUNK_SIZE", 3)
+    # The total number of depths is right, but not that of each line.
+    sdf = "chr22\t100\t1\t2\t3\nchr22\t101\t4\nchr22\t102\t5\t6\n"
+    with pytest.raises(ValueError, match="incorrect sample count"):
+        sdf2gdf(None, ["A", "B"], f=StringIO(sdf))
+    with pytest.raises(ValueError, match="incorrect sample count"):
+        sdf2gdf(None, ["A", "B"], f=StringIO("chr22\t100\n"))
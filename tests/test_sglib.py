@@ -0,0 +1,38 @@
+import pytest
+
+from pypgx.common import VCFFile
+from pypgx.sglib import vcf2biosamples
+
+VCF = (
+    "##fileformat=VCFv4.2\n"
+    "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tA\tB\n"
+    "22\t100\trs1\tA\tG\t.\t.\tPS=D;VI=*2;SO=x;FE=y;RV=z\tGT:AD\t"
+    "0|1:5,5\t1|1:0,10\n"
+    "22\t200\trs2\tC\tT\t.\t.\tPS=.;VI=*3;SO=x;FE=y;RV=z\tGT:AD\t"
+    "{}:4,6\t0|0:10,0\n"
+)
+
+def read_vcf(tmp_path, gt):
+    path = tmp_path / "test.vcf"
+    path.write_text(VCF.format(gt))
+    vcf = VCFFile(str(path))
+    vcf.read()
+    return vcf
+
+def test_vcf2biosamples(tmp_path):
+    samples = vcf2biosamples(read_vcf(tmp_path, "1|0"))
+    a = samples[0].hap
+    assert [x.var for x in a[0].obs] == ["A", "T"]
+    assert [x.var for x in a[1].obs] == ["G", "C"]
+    assert [(x.ad, x.td, x.het) for x in a[1].obs] == [(5, 10, True),
+                                                       (4, 10, True)]
+    samples = vcf2biosamples(read_vcf(tmp_path, "1|0"), filter=True)
+    assert [len(x.hap[0].obs) for x in samples] == [1, 1]
+
+def test_vcf2biosamples_unphased(tmp_path):
+    for gt in ["0/1", "./.", "1"]:
+        with pytest.raises(ValueError):
+            vcf2biosamples(read_vcf(tmp_path, gt))
+    # Unphased genotypes of excluded markers are allowed.
+    samples = vcf2biosamples(read_vcf(tmp_path, "0/1"), filter=True)
+    assert [len(x.hap[1].obs) for x in samples] == [1, 1]
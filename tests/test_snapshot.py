@@ -0,0 +1,84 @@
+import os
+import shutil
+
+from pypgx import snapshot as module
+from pypgx.common import TableRegistry, get_stardb
+from pypgx.snapshot import (
+    load_snapshot, snapshot_path, SNAPSHOT_TABLES
+)
+
+SG_DIR = os.path.join(os.path.dirname(__file__), "../pypgx/resources/sg")
+
+def copy_tables(tmp_path):
+    dirpath = str(tmp_path / "sg")
+    os.mkdir(dirpath)
+    for name in SNAPSHOT_TABLES:
+        shutil.copy(f"{SG_DIR}/{name}.txt", dirpath)
+    return dirpath
+
+def summary(stardb):
+    return {k: (v.score, [x.summary() for x in v.core], v.tag, v.sv)
+            for k, v in stardb.items()}
+
+def test_snapshot_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setenv("PYPGX_CACHE_DIR", str(tmp_path / "cache"))
+    dirpath = copy_tables(tmp_path)
+    snapshot = TableRegistry(dirpath)
+    text = TableRegistry(dirpath, snapshot=False)
+    for gene in ["cyp2d6", "cyp2c19"]:
+        expected = summary(text.stardb(gene, "hg19"))
+        assert summary(snapshot.stardb(gene, "hg19")) == expected
+        assert summary(get_stardb(gene, "hg19")) == expected
+    assert os.path.exists(snapshot_path(dirpath))
+
+def test_snapshot_path(tmp_path):
+    dirpath = copy_tables(tmp_path)
+    assert snapshot_path(dirpath) != snapshot_path(SG_DIR)
+
+def test_snapshot_stale(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    dirpath = copy_tables(tmp_path)
+    load_snapshot(dirpath, cache_dir).close()
+    # Touching a table changes its mtime but not its content.
+    os.utime(f"{dirpath}/gene_table.txt", ns=(0, 0))
+    snapshot = load_snapshot(dirpath, cache_dir)
+    assert snapshot.is_current(dirpath)
+    snapshot.close()
+    with open(f"{dirpath}/star_table.txt", "a") as f:
+        f.write("\n")
+    snapshot = load_snapshot(dirpath, cache_dir)
+    assert snapshot.is_current(dirpath)
+    assert snapshot.header["stats"]["star_table"][1] == os.stat(
+        f"{dirpath}/star_table.txt").st_mtime_ns
+    snapshot.close()
+
+def test_snapshot_touched(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    dirpath = copy_tables(tmp_path)
+    load_snapshot(dirpath, cache_dir).close()
+    calls = []
+    hash_sources = module._hash_sources
+    monkeypatch.setattr(module, "_hash_sources",
+                        lambda x: calls.append(x) or hash_sources(x))
+    os.utime(f"{dirpath}/snp_table.txt", ns=(0, 0))
+    for _ in range(2):
+        snapshot = load_snapshot(dirpath, cache_dir)
+        assert snapshot.rows("cyp2d6")[0] is not None
+        snapshot.close()
+    assert calls == [dirpath]
+
+def test_snapshot_corrupt(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    dirpath = copy_tables(tmp_path)
+    filepath = snapshot_path(dirpath, cache_dir)
+    load_snapshot(dirpath, cache_dir).close()
+    with open(filepath, "rb") as f:
+        data = f.read()
+    size = len(data)
+    for data in [b"garbage", data[:size // 2]]:
+        with open(filepath, "wb") as f:
+            f.write(data)
+        snapshot = load_snapshot(dirpath, cache_dir)
+        assert os.path.getsize(filepath) == size
+        assert snapshot.rows("cyp2d6")[0] is not None
+        snapshot.close()